@@ -0,0 +1,242 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from batch_runner import compute_reports, normalize_reports
+from main import (
+    CountryRegionIndex,
+    FxRateStore,
+    _cache_signature,
+    read_country_region,
+    read_fx_rates,
+    read_portfolio,
+)
+
+## Layout of the store: <output_dir>/<report name>/Valuation_Date=YYYY-MM-DD/part.parquet
+## The partition column is only in the folder name (Hive style), not in the files.
+PARTITION_COLUMN = 'Valuation_Date'
+PART_FILE = 'part.parquet'
+## Snapshot files already computed, with their signature and their valuation dates
+MANIFEST = '_manifest.json'
+
+DEFAULT_REPORTS = [{'type': 'subfund', 'eur': False}, {'type': 'subfund', 'eur': True}]
+
+
+def partition_path(output_dir, report_name, date):
+    """
+    Returns the folder of the partition of a valuation date.
+
+    Args():
+    output_dir: Root folder of the store.
+    report_name: Name of the report (see batch_runner.REPORT_NAMES).
+    date: Valuation date.
+    """
+    return os.path.join(output_dir, report_name, f'{PARTITION_COLUMN}={pd.Timestamp(date):%Y-%m-%d}')
+
+
+def _is_computed(output_dir, reports, date):
+    return all(os.path.exists(os.path.join(partition_path(output_dir, report['name'], date), PART_FILE)) for report in reports)
+
+
+def _write_partition(result, folder):
+    os.makedirs(folder, exist_ok=True)
+    # Write to a temporary file first so an interrupted backfill never leaves a partial partition
+    file_name = os.path.join(folder, PART_FILE)
+    result.to_parquet(f'{file_name}.{os.getpid()}.tmp', index=False)
+    os.replace(f'{file_name}.{os.getpid()}.tmp', file_name)
+
+
+def backfill_file(file_name, output_dir, reports, country_region = None, fx_rates = None, categorical = False, force = False):
+    """
+    Computes the reports of one portfolio snapshot and writes one partition per report and valuation date.
+    The dates whose partitions all exist are not computed again, unless 'force' is set.
+    Returns the list of the valuation dates of the snapshot and the list of the dates computed.
+
+    Args():
+    file_name: Path of the portfolio snapshot.
+    output_dir: Root folder of the store.
+    reports: List of the report specs (see batch_runner.load_job).
+    country_region: Dataframe with 'Country' and 'Region' (or CountryRegionIndex), None without country reports.
+    fx_rates: Optional FxRateStore used for the EUR conversion.
+    categorical: Boolean which reads the portfolio with categorical columns.
+    force: Boolean which computes all the dates of the snapshot again (e.g. the snapshot was corrected).
+    """
+    portfolio = read_portfolio(file_name, categorical=categorical)
+    valuation_dates = pd.to_datetime(pd.Series(portfolio['Valuation_Date'], dtype=object))
+    dates = [pd.Timestamp(date) for date in sorted(valuation_dates.dropna().unique())]
+    missing = [date for date in dates if force or not _is_computed(output_dir, reports, date)]
+    if not missing:
+        return dates, []
+
+    # Only the deals of the dates not computed yet. A date is complete in its snapshot,
+    # so the denominators of its reports are the same as with the whole file.
+    portfolio = portfolio[valuation_dates.isin(missing).to_numpy()]
+    results, unmapped = compute_reports(portfolio, country_region, reports, fx_rates)
+
+    for report in reports:
+        result = results[report['name']]
+        result_dates = pd.to_datetime(pd.Series(result[PARTITION_COLUMN], dtype=object)).to_numpy()
+        for date in missing:
+            # A date without lines still gets an (empty) partition, so it is not computed again
+            part = result[result_dates == date].drop(columns=PARTITION_COLUMN)
+            _write_partition(part.reset_index(drop=True), partition_path(output_dir, report['name'], date))
+    return dates, missing
+
+
+def _read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_manifest(output_dir, manifest):
+    file_name = os.path.join(output_dir, MANIFEST)
+    with open(file_name + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(file_name + '.tmp', file_name)
+
+
+def backfill(input_dir, output_dir, reports = None, country_region = None, fx_rates = None, workers = None, pattern = '*.csv', categorical = False):
+    """
+    Computes the reports of every portfolio snapshot of a folder, in parallel, into a store
+    partitioned by valuation date (see partition_path). The backfill can be stopped and run again:
+    the snapshots recorded in the manifest (same size and modification time, partitions present)
+    are not read again, and for the new or interrupted snapshots the dates whose partitions all exist
+    are not computed again. A snapshot changed since it was recorded is computed again entirely,
+    and the partitions of the dates it no longer holds are removed.
+    Returns a dict snapshot -> list of the dates computed.
+
+    Args():
+    input_dir: Folder with the portfolio snapshots.
+    output_dir: Root folder of the store.
+    reports: List of the report specs (see batch_runner.load_job). Default value the subfund reports in Asset CCY and in EUR.
+    country_region: Dataframe with 'Country' and 'Region' (or CountryRegionIndex), needed for the country reports.
+    fx_rates: Optional FxRateStore used for the EUR conversion.
+    workers: Number of processes. Default value the number of CPUs.
+    pattern: Pattern of the snapshot file names.
+    categorical: Boolean which reads the portfolios with categorical columns.
+    """
+    reports = normalize_reports([dict(report) for report in (reports or DEFAULT_REPORTS)])
+    if any(report['type'] == 'country_region' for report in reports):
+        if country_region is None:
+            raise ValueError("The country reports need 'country_region'")
+        if not isinstance(country_region, CountryRegionIndex):
+            country_region = CountryRegionIndex(country_region)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _read_manifest(output_dir)
+    names = sorted(report['name'] for report in reports)
+
+    # Check the snapshots that are already computed
+    pending = {}
+    for file_name in sorted(glob.glob(os.path.join(input_dir, pattern))):
+        key = os.path.relpath(file_name, input_dir)
+        signature = _cache_signature(file_name, categorical).decode()
+        entry = manifest.get(key)
+        if (
+            entry is not None
+            and entry['signature'] == signature
+            and set(names) <= set(entry['reports'])
+            and all(_is_computed(output_dir, reports, date) for date in entry['dates'])
+        ):
+            continue
+        # A snapshot changed since it was recorded: its partitions are stale
+        force = entry is not None and entry['signature'] != signature
+        pending[key] = (file_name, signature, force)
+
+    done = {}
+
+    def record(key, dates, computed):
+        # The dates removed from a changed snapshot
+        if pending[key][2]:
+            kept = {f'{pd.Timestamp(date):%Y-%m-%d}' for date in dates}
+            for date in set(manifest[key]['dates']) - kept:
+                for report in reports:
+                    shutil.rmtree(partition_path(output_dir, report['name'], date), ignore_errors=True)
+        # The manifest is written after every snapshot, so an interrupted backfill restarts from there
+        manifest[key] = {
+            'signature': pending[key][1],
+            'dates': [f'{pd.Timestamp(date):%Y-%m-%d}' for date in dates],
+            'reports': names,
+        }
+        _write_manifest(output_dir, manifest)
+        done[key] = computed
+
+    arguments = (output_dir, reports, country_region, fx_rates, categorical)
+    if workers == 1 or len(pending) <= 1:
+        for key, (file_name, signature, force) in pending.items():
+            record(key, *backfill_file(file_name, *arguments, force))
+    else:
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as executor:
+            futures = {executor.submit(backfill_file, file_name, *arguments, force): key for key, (file_name, signature, force) in pending.items()}
+            for future in as_completed(futures):
+                record(futures[future], *future.result())
+    return done
+
+
+def read_exposures(output_dir, report_name, subfund = None, start = None, end = None, columns = None):
+    """
+    Reads a report from the store. Only the partitions of the dates between 'start' and 'end'
+    are opened, and only the lines of 'subfund' are read from them.
+
+    Args():
+    output_dir: Root folder of the store.
+    report_name: Name of the report (see batch_runner.REPORT_NAMES).
+    subfund: Optional Subfund_Code. Default value all the subfunds.
+    start: Optional first valuation date (included).
+    end: Optional last valuation date (included).
+    columns: Optional list of the columns read. Default value all the columns.
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    folder = os.path.join(output_dir, report_name)
+    prefix = PARTITION_COLUMN + '='
+
+    parts = []
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if not name.startswith(prefix):
+            continue
+        date = pd.Timestamp(name[len(prefix):])
+        if (start is not None and date < start) or (end is not None and date > end):
+            continue
+        filters = [('Subfund_Code', '==', subfund)] if subfund is not None else None
+        part = pd.read_parquet(os.path.join(folder, name, PART_FILE), columns=columns, filters=filters)
+        part.insert(min(1, len(part.columns)), PARTITION_COLUMN, date)
+        parts.append(part)
+
+    if not parts:
+        return pd.DataFrame(columns=[PARTITION_COLUMN])
+    return pd.concat(parts, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the exposure reports of a folder of portfolio snapshots into a store partitioned by valuation date.")
+    parser.add_argument("input_dir", help="folder with the portfolio snapshots")
+    parser.add_argument("output_dir", help="root folder of the store")
+    parser.add_argument("--pattern", default="*.csv", help="pattern of the snapshot file names")
+    parser.add_argument("--country-region", help="country/region file, adds the country reports")
+    parser.add_argument("--fx-rates", help="FX rates file, default the fixed rates")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args()
+
+    reports = list(DEFAULT_REPORTS)
+    country_region = None
+    if args.country_region:
+        country_region = read_country_region(args.country_region)
+        reports += [{'type': 'country_region', 'eur': False}, {'type': 'country_region', 'eur': True}]
+    fx_rates = FxRateStore(read_fx_rates(args.fx_rates)) if args.fx_rates else None
+
+    done = backfill(args.input_dir, args.output_dir, reports, country_region, fx_rates, args.workers, args.pattern)
+    for key, dates in sorted(done.items()):
+        print(f"{key}: {len(dates)} date(s) computed")
+    print(f"{len(done)} snapshot(s) processed")
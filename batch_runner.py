@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from main import (
+    EXPOSURES,
+    REPORTS,
+    CountryRegionIndex,
+    FxRateStore,
+    aggregate_exposures,
+    convert_to_eur,
+    _warn_unmapped,
+    map_country_region,
+    prepare_exposures,
+    read_country_region,
+    read_fx_rates,
+    read_portfolio,
+)
+
+## Default file names of the reports, as written by main.py
+REPORT_NAMES = {
+    ('subfund', False): 'Subfund_Metric_AssetCCY',
+    ('subfund', True): 'Subfund_Metric_EurCCY',
+    ('country_region', False): 'CountryRegion_Metric_AssetCCY',
+    ('country_region', True): 'CountryRegion_Metric_EurCCY',
+}
+FORMATS = ['csv', 'parquet']
+
+
+def load_job(file_name):
+    """
+    Reads and checks a job spec. Example (JSON):
+
+    {
+        "output_dir": "reports",
+        "format": "csv",
+        "fx_rates": "fx_rates.csv",
+        "portfolios": [
+            {"name": "example", "file": "example_portfolio.csv", "country_region": "country_region.csv"}
+        ],
+        "reports": [
+            {"type": "subfund", "eur": false},
+            {"type": "country_region", "eur": true, "asset_classes": ["Equity"], "exposures": ["net"]}
+        ]
+    }
+
+    'fx_rates' is optional (default the fixed rates of EUR_RATES). 'name' of a report is optional,
+    it is required when two reports of a portfolio would get the same default name.
+    'country_region' is required for every portfolio when the job has country reports.
+
+    Args():
+    file_name: Path of the JSON file.
+    """
+    with open(file_name) as file:
+        job = json.load(file)
+
+    job.setdefault('output_dir', '.')
+    job.setdefault('format', 'csv')
+    if job['format'] not in FORMATS:
+        raise ValueError(f"Unknown format {job['format']!r}, expected one of {FORMATS}")
+    job['reports'] = normalize_reports(job['reports'])
+    if any(report['type'] == 'country_region' for report in job['reports']):
+        missing = [spec['file'] for spec in job['portfolios'] if not spec.get('country_region')]
+        if missing:
+            raise ValueError(f"The country reports need a 'country_region' for the portfolios {missing}")
+    return job
+
+
+def normalize_reports(reports):
+    """
+    Checks a list of report specs and fills the default values (see load_job).
+
+    Args():
+    reports: List of the report specs, as dicts with at least 'type'.
+    """
+    for report in reports:
+        report.setdefault('eur', False)
+        if (report['type'], bool(report['eur'])) not in REPORTS:
+            raise ValueError(f"Unknown report type {report['type']!r}")
+        report.setdefault('asset_classes', ['Equity', 'Fixed Income'])
+        report.setdefault('exposures', list(EXPOSURES))
+        report.setdefault('name', REPORT_NAMES[(report['type'], bool(report['eur']))])
+    names = [report['name'] for report in reports]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Several reports are named {duplicates}, give them a 'name'")
+    return reports
+
+
+def compute_reports(portfolio, country_region, reports, fx_rates = None):
+    """
+    Computes the reports of one portfolio. The region mapping, the EUR conversion and the
+    per-deal exposures and denominators are computed once and shared by all the reports.
+    Returns a dict report name -> DataFrame, and the DataFrame of the unmapped countries.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    country_region: Dataframe with 'Country' and 'Region' (or CountryRegionIndex), None without country reports
+        (or when the portfolio is the output of map_country_region).
+    reports: List of the report specs (see load_job).
+    fx_rates: Optional FxRateStore used for the EUR conversion.
+    """
+    unmapped = None
+    if any(report['type'] == 'country_region' for report in reports) and 'Region' not in portfolio.columns:
+        if country_region is None:
+            raise ValueError("The country reports need 'country_region'")
+        portfolio, unmapped = map_country_region(country_region, portfolio)
+
+    # Shared intermediates, by currency of the report
+    shared = {}
+    for eur in sorted({bool(report['eur']) for report in reports}):
+        values = convert_to_eur(portfolio, fx_rates) if eur else portfolio['Market_Value_in_Subfund_CCY']
+        data_group_total = REPORTS[('subfund', eur)][1]
+        shared[eur] = (values, data_group_total, prepare_exposures(portfolio, data_group_total, values))
+
+    results = {}
+    for report in reports:
+        eur = bool(report['eur'])
+        values, data_group_total, exposures = shared[eur]
+        data_group = REPORTS[(report['type'], eur)][0]
+        if report['type'] == 'subfund':
+            results[report['name']] = aggregate_exposures(portfolio, data_group, data_group_total, values, exposures=exposures)
+        else:
+            # Exclude the Countries that are not needed, the currency and the other asset classes
+            mask = (
+                portfolio['Region'].notnull()
+                & (portfolio['Asset_Class'] != 'Currency')
+                & portfolio['Asset_Class'].isin(report['asset_classes'])
+            )
+            result = aggregate_exposures(portfolio, data_group, data_group_total, values, mask=mask, exposures=exposures)
+            columns = data_group + ['ExposurePercentage_' + name for name in EXPOSURES if name in report['exposures']]
+            results[report['name']] = result[columns]
+    return results, unmapped
+
+
+def write_report(result, file_name, format = 'csv'):
+    """
+    Writes a report in CSV (buffered) or Parquet.
+
+    Args():
+    result: DataFrame of the report.
+    file_name: Path of the file, without extension.
+    format: 'csv' or 'parquet'.
+    """
+    if format == 'parquet':
+        result.to_parquet(file_name + '.parquet', index=False)
+    else:
+        with open(file_name + '.csv', 'w', buffering=1 << 20, newline='') as file:
+            result.to_csv(file, index=False)
+    return file_name + '.' + format
+
+
+def run_job(job, workers = 4):
+    """
+    Runs a job spec: every portfolio is loaded once, its reports are computed from shared
+    intermediates and written by a pool of threads while the next portfolio is computed.
+    Returns the list of the written files.
+
+    Args():
+    job: Job spec (see load_job).
+    workers: Number of threads writing the reports.
+    """
+    os.makedirs(job['output_dir'], exist_ok=True)
+    fx_rates = FxRateStore(read_fx_rates(job['fx_rates'])) if job.get('fx_rates') else None
+    country_regions = {}
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for spec in job['portfolios']:
+            portfolio = read_portfolio(spec['file'], categorical=spec.get('categorical', False), cache=spec.get('cache', False))
+
+            country_region = None
+            if spec.get('country_region'):
+                # The country/region index is compiled once per file
+                if spec['country_region'] not in country_regions:
+                    country_regions[spec['country_region']] = CountryRegionIndex(read_country_region(spec['country_region']))
+                country_region = country_regions[spec['country_region']]
+
+            results, unmapped = compute_reports(portfolio, country_region, job['reports'], fx_rates)
+            if unmapped is not None:
+                _warn_unmapped(unmapped, spec['file'])
+
+            prefix = spec.get('name', os.path.splitext(os.path.basename(spec['file']))[0])
+            for name, result in results.items():
+                file_name = os.path.join(job['output_dir'], f'{prefix}_{name}')
+                futures.append(executor.submit(write_report, result, file_name, job['format']))
+
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute and write the exposure reports listed in a job spec.")
+    parser.add_argument("job", help="JSON file with the job spec")
+    parser.add_argument("--workers", type=int, default=4, help="number of threads writing the reports")
+    args = parser.parse_args()
+
+    for file_name in run_job(load_job(args.job), args.workers):
+        print(f"Written {file_name}")
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from main import (
+    EUR_RATES,
+    calculate_metrics,
+    calculate_metrics_CountryRegion,
+    calculate_volAnnualized,
+    calculate_volAnnualized_batch,
+    map_country_region,
+    read_portfolio,
+)
+
+## Countries used by the generator before the synthetic names
+COUNTRIES = ['France', 'Spain', 'United States of America', 'Germany', 'Japan', 'China', 'Italy', 'Russia']
+REGIONS = {
+    'France': 'Europe',
+    'Spain': 'Europe',
+    'United States of America': 'North America',
+    'Germany': 'Europe',
+    'Japan': 'Asia',
+    'China': 'Asia',
+    'Italy': 'Europe',
+}
+ASSET_CLASSES = ['Equity', 'Fixed Income', 'Currency']
+
+## Default sizes (number of deals) of the benchmark
+SIZES = [1000, 10000, 100000]
+## A timing slower than the baseline by more than this factor is reported as a regression
+REGRESSION_THRESHOLD = 1.25
+
+
+def generate_portfolio(rows = 10000, subfunds = 10, dates = 5, currencies = 5, countries = 8, short_ratio = 0.2, seed = 0):
+    """
+    Generates a portfolio with the columns of example_portfolio.csv, in the format of read_portfolio.
+
+    Args():
+    rows: Number of deals.
+    subfunds: Number of subfunds.
+    dates: Number of valuation dates (business days).
+    currencies: Number of asset currencies, taken from EUR_RATES.
+    countries: Number of countries of risk. The countries after the known ones have no region.
+    short_ratio: Share of the deals with a negative market value.
+    seed: Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    subfund_codes = np.array(['subfund%03d' % i for i in range(1, subfunds + 1)])
+    valuation_dates = pd.bdate_range('2021-01-04', periods=dates).date
+    ccys = np.array(list(EUR_RATES)[:currencies])
+    country_names = np.array((COUNTRIES + ['Country%03d' % i for i in range(countries)])[:countries])
+
+    asset_class = rng.choice(ASSET_CLASSES, rows, p=[0.55, 0.4, 0.05])
+    country = rng.choice(country_names, rows).astype(object)
+    country[asset_class == 'Currency'] = np.nan
+    sign = np.where(rng.random(rows) < short_ratio, -1.0, 1.0)
+
+    return pd.DataFrame({
+        'Subfund_Code': rng.choice(subfund_codes, rows),
+        'Valuation_Date': rng.choice(valuation_dates, rows),
+        'Subfund_CCY': 'EUR',
+        'Subfund_Long_Name': '简',
+        'Asset_Code': ['asset%07d' % i for i in range(1, rows + 1)],
+        'Asset_CCY': rng.choice(ccys, rows),
+        'Market_Value_in_Subfund_CCY': np.round(sign * rng.lognormal(13, 1.5, rows), 2),
+        'Asset_Class': asset_class,
+        'Country_of_Risk': country,
+        'Is_Hedge': rng.random(rows) < 0.1,
+    })
+
+
+def generate_country_region(countries = 8):
+    """
+    Generates the 'country_region' DataFrame of the countries known by the generator.
+
+    Args():
+    countries: Number of countries of risk used by generate_portfolio.
+    """
+    names = [country for country in COUNTRIES[:countries] if country in REGIONS]
+    return pd.DataFrame({'Country': names, 'Region': [REGIONS[country] for country in names]})
+
+
+def generate_navs(subfunds = 10, dates = 250, frequency = 'B', seed = 0):
+    """
+    Generates a NAV history in the format of read_subfund_navs (latest date first).
+
+    Args():
+    subfunds: Number of subfunds.
+    dates: Number of NAVs per subfund.
+    frequency: Pandas frequency of the NAVs ('B' daily, 'W' weekly).
+    seed: Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    valuation_dates = pd.date_range('2015-01-01', periods=dates, freq=frequency).date
+    navs = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (subfunds, dates)), axis=1))
+    df = pd.DataFrame({
+        'Subfund_Code': np.repeat(['subfund%03d' % i for i in range(1, subfunds + 1)], dates),
+        'Valuation_Date': np.tile(valuation_dates, subfunds),
+        'NAV': np.round(navs.ravel(), 2),
+    })
+    return df.sort_values('Valuation_Date', ascending=False, kind='mergesort').reset_index(drop=True)
+
+
+def write_portfolio(portfolio, file_name):
+    """
+    Writes a generated portfolio in the CSV format read by read_portfolio.
+
+    Args():
+    portfolio: DataFrame returned by generate_portfolio.
+    file_name: Path of the CSV.
+    """
+    df = portfolio.copy()
+    df['Valuation_Date'] = pd.to_datetime(df['Valuation_Date']).dt.strftime('%d/%m/%Y')
+    df['Is_Hedge'] = np.where(df['Is_Hedge'], 'Yes', 'No')
+    df.to_csv(file_name, index=False, float_format='%.2f')
+
+
+def measure(function, rows, repeat = 3):
+    """
+    Returns the best wall time of 'repeat' runs, the peak memory allocated during one run
+    (tracemalloc) and the throughput in rows per second.
+
+    Args():
+    function: Callable without arguments.
+    rows: Number of input rows processed by the callable.
+    repeat: Number of timed runs.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+
+    # The memory is measured on a separate run, tracemalloc slows down the execution
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': seconds, 'peak_mb': peak / 2**20, 'rows_per_second': rows / seconds if seconds else float('inf')}
+
+
+def run_benchmark(sizes = SIZES, subfunds = 10, dates = 5, repeat = 3, seed = 0):
+    """
+    Benchmarks the entry points of main.py on generated inputs of every size.
+    Returns a DataFrame with one line per entry point and size.
+
+    Args():
+    sizes: List with the number of deals of the generated portfolios.
+    subfunds: Number of subfunds.
+    dates: Number of valuation dates.
+    repeat: Number of timed runs.
+    seed: Seed of the random generator.
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in sizes:
+            portfolio = generate_portfolio(rows, subfunds, dates, seed=seed)
+            country_region = generate_country_region()
+            file_name = os.path.join(folder, 'portfolio_%d.csv' % rows)
+            write_portfolio(portfolio, file_name)
+            portfolio = read_portfolio(file_name)
+            portfolio_region, unmapped = map_country_region(country_region, portfolio)
+
+            # The NAV history has as many observations as the portfolio has deals
+            navs = generate_navs(subfunds, max(rows // subfunds, 2), seed=seed)
+            navs_dates = pd.to_datetime(navs['Valuation_Date'])
+            date_vol = navs_dates.max() + pd.Timedelta(days=1)
+            navs_vol = navs.assign(Valuation_Date=navs_dates)
+
+            cases = {
+                'read_portfolio': lambda: read_portfolio(file_name),
+                'calculate_metrics': lambda: calculate_metrics(portfolio),
+                'calculate_metrics_EUR': lambda: calculate_metrics(portfolio, exposureEUR=True),
+                'calculate_metrics_CountryRegion': lambda: calculate_metrics_CountryRegion(country_region, portfolio),
+                'calculate_metrics_CountryRegion_mapped': lambda: calculate_metrics_CountryRegion(country_region, portfolio_region),
+                'calculate_volAnnualized': lambda: calculate_volAnnualized(navs_vol, 'subfund001', date_vol),
+                'calculate_volAnnualized_batch': lambda: calculate_volAnnualized_batch(navs),
+            }
+            for name, function in cases.items():
+                record = {'entry_point': name, 'rows': rows}
+                record.update(measure(function, rows, repeat))
+                records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def compare_baseline(results, baseline, threshold = REGRESSION_THRESHOLD):
+    """
+    Adds the timing of the baseline and flags the entry points slower than 'threshold' times the baseline.
+
+    Args():
+    results: DataFrame returned by run_benchmark.
+    baseline: DataFrame with the same columns (a previous run).
+    threshold: Ratio above which a timing is a regression.
+    """
+    baseline = baseline[['entry_point', 'rows', 'seconds']].rename(columns={'seconds': 'baseline_seconds'})
+    results = results.merge(baseline, on=['entry_point', 'rows'], how='left')
+    results['ratio'] = results['seconds'] / results['baseline_seconds']
+    results['regression'] = results['ratio'] > threshold
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exposure and volatility entry points on generated data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="number of deals of the generated portfolios")
+    parser.add_argument("--subfunds", type=int, default=10)
+    parser.add_argument("--dates", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="JSON file with the stored baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.subfunds, args.dates, args.repeat)
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            baseline = pd.DataFrame(json.load(file))
+        results = compare_baseline(results, baseline, args.threshold)
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(results.to_string(index=False))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results.to_dict(orient="records"), file, indent=2)
+        print(f"Baseline saved in {args.baseline}")
+    elif "regression" in results and results["regression"].any():
+        raise SystemExit(1)
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from main import EXPOSURES, REPORTS, convert_to_eur
+
+
+class ExposureBook:
+    """
+    Keeps the exposures of calculate_metrics up to date while deals are inserted, updated or deleted.
+    Only the sums of the groups touched by a change are adjusted, so a refresh costs
+    the size of the change and not the size of the portfolio.
+
+    The deals are identified by (Subfund_Code, Valuation_Date, Asset_Code) and must use the
+    same formats as the output of read_portfolio. Two lines of the same asset (e.g. two lots)
+    must be aggregated before they enter the book.
+
+    Args():
+    portfolio: DataFrame with the deals used to seed the book.
+    exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+    fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+    """
+
+    def __init__(self, portfolio, exposureEUR = False, fx_rates = None):
+        self.exposureEUR = exposureEUR
+        self.fx_rates = fx_rates
+        self.data_group, self.data_group_total = REPORTS[('subfund', bool(exposureEUR))]
+
+        # (Subfund_Code, Valuation_Date, Asset_Code) -> (group, total group, value)
+        self._positions = {}
+        # group -> [number of deals, net, long, short, gross]
+        self._sums = {}
+        # total group -> [number of deals, gross]
+        self._totals = {}
+        # total group -> groups reported with this denominator
+        self._groups = {}
+
+        self.upsert(portfolio)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def upsert(self, deals):
+        """
+        Inserts the new deals and replaces the existing ones.
+        Returns the exposures of the groups whose denominator changed, and the groups left
+        without deals with NaN percentages (see _changes).
+        Raises ValueError (and leaves the book unchanged) when several deals have the same key.
+
+        Args():
+        deals: DataFrame with the deals, in the format of read_portfolio.
+        """
+        keys = list(zip(deals['Subfund_Code'], deals['Valuation_Date'], deals['Asset_Code']))
+        # Check the duplicated keys, only the last deal would be kept
+        if len(set(keys)) != len(keys):
+            duplicates = pd.Series(keys).loc[pd.Series(keys).duplicated()].unique().tolist()
+            raise ValueError(f"Several deals have the same (Subfund_Code, Valuation_Date, Asset_Code): {duplicates[:5]}")
+
+        if self.exposureEUR == False:
+            values = deals['Market_Value_in_Subfund_CCY']
+        else:
+            values = convert_to_eur(deals, self.fx_rates)
+
+        changed = set()
+        touched = set()
+        columns = [deals[column] for column in self.data_group]
+        columns_total = [deals[column] for column in self.data_group_total]
+        for key, group, total_group, value in zip(
+            keys,
+            zip(*columns),
+            zip(*columns_total),
+            values.to_numpy(dtype=float),
+        ):
+            previous = self._positions.pop(key, None)
+            if previous is not None:
+                self._add(previous[0], previous[1], previous[2], -1)
+                changed.add(previous[1])
+                touched.add(previous[0])
+            self._positions[key] = (group, total_group, value)
+            self._add(group, total_group, value, 1)
+            changed.add(total_group)
+
+        return self._changes(changed, touched)
+
+    def delete(self, deals):
+        """
+        Removes the deals from the book. Unknown deals are ignored.
+        Returns the exposures of the groups whose denominator changed, and the groups left
+        without deals with NaN percentages (see _changes).
+
+        Args():
+        deals: DataFrame with the 'Subfund_Code', 'Valuation_Date' and 'Asset_Code' of the deals.
+        """
+        changed = set()
+        touched = set()
+        for key in zip(deals['Subfund_Code'], deals['Valuation_Date'], deals['Asset_Code']):
+            previous = self._positions.pop(key, None)
+            if previous is not None:
+                self._add(previous[0], previous[1], previous[2], -1)
+                changed.add(previous[1])
+                touched.add(previous[0])
+
+        return self._changes(changed, touched)
+
+    def exposures(self, total_groups = None):
+        """
+        Returns the exposures in the format of calculate_metrics.
+        A group without deals left is not reported.
+
+        Args():
+        total_groups: Optional iterable with the denominator groups to report. Default value all the groups.
+        """
+        if total_groups is None:
+            total_groups = self._groups.keys()
+
+        groups = []
+        totals = []
+        for total_group in total_groups:
+            for group in self._groups.get(total_group, ()):
+                groups.append(group)
+                totals.append(self._totals[total_group][1])
+
+        sums = np.array([self._sums[group][1:] for group in groups], dtype=float).reshape(len(groups), len(EXPOSURES))
+        result = pd.DataFrame(groups, columns=self.data_group) if groups else pd.DataFrame(columns=self.data_group)
+        totals = np.array(totals, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, name in enumerate(EXPOSURES):
+                result['ExposurePercentage_' + name] = sums[:, i] / totals * 100
+
+        return result.sort_values(self.data_group, kind='mergesort').reset_index(drop=True)
+
+    def _changes(self, total_groups, groups):
+        # The groups whose last deal was removed are reported with NaN percentages,
+        # so a consumer applying the changes knows which lines to drop
+        result = self.exposures(total_groups)
+        removed = [group for group in groups if group not in self._sums]
+        if not removed:
+            return result
+        result = pd.concat([result, pd.DataFrame(removed, columns=self.data_group)], ignore_index=True)
+        return result.sort_values(self.data_group, kind='mergesort').reset_index(drop=True)
+
+    def _add(self, group, total_group, value, sign):
+        # Deals in a currency without a rate do not contribute, like in calculate_metrics
+        if value != value:
+            value = 0.0
+
+        sums = self._sums.get(group)
+        if sums is None:
+            sums = self._sums[group] = [0, 0.0, 0.0, 0.0, 0.0]
+            self._groups.setdefault(total_group, set()).add(group)
+        sums[0] += sign
+        sums[1] += sign * value
+        sums[2] += sign * max(value, 0.0)
+        sums[3] += sign * min(value, 0.0)
+        sums[4] += sign * abs(value)
+
+        totals = self._totals.get(total_group)
+        if totals is None:
+            totals = self._totals[total_group] = [0, 0.0]
+        totals[0] += sign
+        totals[1] += sign * abs(value)
+
+        # Drop the empty groups so no rounding residue is left behind
+        if sums[0] == 0:
+            del self._sums[group]
+            self._groups[total_group].discard(group)
+        if totals[0] == 0:
+            del self._totals[total_group]
+            del self._groups[total_group]
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import pandas as pd
+
+from main import CountryRegionIndex, FxRateStore, calculate_metrics, calculate_metrics_CountryRegion
+
+
+def fingerprint(data):
+    """
+    Returns a hash of the content of a DataFrame (values, index, columns and dtypes).
+    A CountryRegionIndex is hashed from its countries and regions, a FxRateStore from its history of rates.
+
+    Args():
+    data: DataFrame, CountryRegionIndex or FxRateStore.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(data, FxRateStore):
+        data = data.to_frame()
+    if isinstance(data, CountryRegionIndex):
+        data = pd.DataFrame({
+            'Country': data.countries,
+            'Region': pd.Categorical.from_codes(data.region_codes, categories=data.region_categories),
+        })
+    digest.update(repr(list(zip(data.columns, data.dtypes.astype(str)))).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ExposureCache:
+    """
+    Memoizes calculate_metrics and calculate_metrics_CountryRegion.
+    The results are keyed by the fingerprint of the input DataFrames and the call parameters,
+    kept in an in-memory LRU of 'maxsize' entries and optionally stored in 'directory'.
+
+    Args():
+    maxsize: Maximum number of results kept in memory.
+    directory: Optional folder used as a second, persistent tier.
+    """
+
+    def __init__(self, maxsize = 128, directory = None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'size': len(self._results),
+            'maxsize': self.maxsize,
+        }
+
+    def clear(self):
+        """
+        Empties the in-memory tier and resets the counters. The files of the disk tier are kept.
+        """
+        self._results.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def calculate_metrics(self, portfolio, exposureEUR = False, fx_rates = None):
+        """
+        Cached calculate_metrics. See calculate_metrics for the arguments.
+        """
+        frames = [portfolio] + self._rates(exposureEUR, fx_rates)
+        key = self._key('calculate_metrics', frames, {'exposureEUR': bool(exposureEUR)})
+        return self._get(key, lambda: calculate_metrics(portfolio, exposureEUR, fx_rates))
+
+    def calculate_metrics_CountryRegion(self, country_region, portfolio, Asset_Class = ['Equity', 'Fixed Income'], exposure = ['net', 'long', 'short', 'gross'], exposureEUR = False, fx_rates = None):
+        """
+        Cached calculate_metrics_CountryRegion. See calculate_metrics_CountryRegion for the arguments.
+        """
+        parameters = {
+            'Asset_Class': sorted(Asset_Class),
+            'exposure': sorted(exposure),
+            'exposureEUR': bool(exposureEUR),
+        }
+        frames = [country_region, portfolio] + self._rates(exposureEUR, fx_rates)
+        key = self._key('calculate_metrics_CountryRegion', frames, parameters)
+        return self._get(key, lambda: calculate_metrics_CountryRegion(country_region, portfolio, Asset_Class, exposure, exposureEUR, fx_rates))
+
+    def _rates(self, exposureEUR, fx_rates):
+        # The rates are part of the key of the EUR results only, the fixed rates of EUR_RATES have none
+        if exposureEUR and fx_rates is not None:
+            return [fx_rates]
+        return []
+
+    def _key(self, function, frames, parameters):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(function.encode())
+        for frame in frames:
+            digest.update(fingerprint(frame).encode())
+        digest.update(repr(sorted(parameters.items())).encode())
+        return digest.hexdigest()
+
+    def _get(self, key, compute):
+        result = self._results.get(key)
+        if result is not None:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return result.copy()
+
+        result = self._read(key)
+        if result is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            result = compute()
+            self._write(key, result)
+
+        self._results[key] = result
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+        return result.copy()
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        file_name = os.path.join(self.directory, key + '.pkl')
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'rb') as file:
+            return pickle.load(file)
+
+    def _write(self, key, result):
+        if self.directory is None:
+            return
+        # Write to a temporary file first so a concurrent reader never sees a partial result
+        file_name = os.path.join(self.directory, key + '.pkl')
+        with open(file_name + '.tmp', 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file_name + '.tmp', file_name)
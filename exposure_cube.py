@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+from main import EUR_RATES, EXPOSURES, REPORTS, CountryRegionIndex, _exposure_columns
+
+## Finest grain of the cube. Sector is used when the portfolio has it.
+CUBE_COLUMNS = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Country_of_Risk', 'Sector']
+
+
+class ExposureCube:
+    """
+    Net, long, short and gross sums of the deals at the finest grain
+    (subfund, date, asset class, currency, country of risk and sector), computed once.
+    Any coarser view is answered by summing the cells instead of scanning the deals again.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    country_region: Optional Dataframe with 'Country' and 'Region' (or CountryRegionIndex), to add the 'Region' of the cells.
+    """
+
+    def __init__(self, portfolio, country_region = None):
+        self.columns = [column for column in CUBE_COLUMNS if column in portfolio.columns]
+
+        exposures = _exposure_columns(portfolio['Market_Value_in_Subfund_CCY'], deals=True)
+
+        # The cells are grouped on the codes of the columns, so the deals without a country
+        # (currency deals, code -1) are kept: they count in the denominators
+        codes = []
+        labels = []
+        for column in self.columns:
+            column_codes, column_labels = pd.factorize(portfolio[column], sort=True)
+            codes.append(column_codes)
+            labels.append(column_labels)
+        sums = exposures.groupby(codes, sort=True).sum()
+        cells = {
+            column: column_labels.take(sums.index.get_level_values(i).to_numpy(), allow_fill=True, fill_value=np.nan)
+            for i, (column, column_labels) in enumerate(zip(self.columns, labels))
+        }
+        self.cells = pd.DataFrame(cells).join(sums.reset_index(drop=True))
+
+        if country_region is not None:
+            self.add_regions(country_region)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add_regions(self, country_region):
+        """
+        Adds the 'Region' of the country of risk to the cells.
+
+        Args():
+        country_region: Dataframe with 'Country' and 'Region', or the CountryRegionIndex built from it
+        """
+        if not isinstance(country_region, CountryRegionIndex):
+            country_region = CountryRegionIndex(country_region)
+        self.cells['Region'] = country_region.region_of(self.cells['Country_of_Risk'])
+
+    def rollup(self, by, total_by = None, exposureEUR = False, fx_rates = None, where = None):
+        """
+        Sums the cells by the columns 'by'.
+        Returns the 'net', 'long', 'short', 'gross' sums and the number of 'deals' of every line and,
+        when 'total_by' is given, the exposure percentages with the gross total of 'total_by' as denominator.
+
+        Args():
+        by: List of the columns of the view (cube columns and 'Region').
+        total_by: Optional list of the columns of the denominator (included in 'by').
+        exposureEUR: Boolean which sums the cells in EUR (converting all the currency to EUR) or in the Asset CCY.
+        fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+        where: Optional dict column -> list of the values kept. The other cells still count in the denominator.
+        """
+        cells = self.cells
+        if exposureEUR:
+            # All the deals of a cell share the Asset CCY and the date, so the sums can be converted to EUR directly
+            if fx_rates is None:
+                rates = np.asarray(cells['Asset_CCY'].map(EUR_RATES), dtype=float)
+            else:
+                rates = fx_rates.lookup(cells['Valuation_Date'], cells['Asset_CCY'])
+            cells = cells.assign(**{name: cells[name] / rates for name in EXPOSURES})
+
+        selected = cells
+        if where:
+            mask = np.ones(len(cells), dtype=bool)
+            for column, kept in where.items():
+                mask &= cells[column].isin(kept).to_numpy()
+            selected = cells[mask]
+
+        result = selected.groupby(list(by), observed=True, sort=True)[EXPOSURES + ['deals']].sum().sort_index().reset_index()
+        if total_by is None:
+            return result
+
+        # The denominator is computed on all the cells, before 'where' is applied
+        totals = cells.groupby(list(total_by), observed=True)['gross'].sum().rename('Total_CCY').reset_index()
+        result = result.merge(totals, on=list(total_by), how='left')
+        for name in EXPOSURES:
+            result['ExposurePercentage_' + name] = result[name] / result['Total_CCY'] * 100
+        return result
+
+    def calculate_metrics(self, exposureEUR = False, fx_rates = None):
+        """
+        Same report as calculate_metrics, from the cube.
+
+        Args():
+        exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+        fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+        """
+        data_group, data_group_total = REPORTS[('subfund', bool(exposureEUR))]
+        result = self.rollup(data_group, data_group_total, exposureEUR, fx_rates)
+        return result[data_group + ['ExposurePercentage_' + name for name in EXPOSURES]]
+
+    def calculate_metrics_CountryRegion(self, Asset_Class = ['Equity', 'Fixed Income'], exposure = ['net', 'long', 'short', 'gross'], exposureEUR = False, fx_rates = None):
+        """
+        Same report as calculate_metrics_CountryRegion, from the cube. The regions must have been added.
+
+        Args():
+        Asset_Class: List of the asset classes to be calculated for the exposure. Default value 'Equity','Fixed Income'
+        exposure: List of the exposures to be displayed. Default value 'net', 'long', 'short', 'gross'
+        exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY
+        fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+        """
+        if 'Region' not in self.cells.columns:
+            raise ValueError("The regions are missing, build the cube with 'country_region' or call add_regions")
+
+        data_group, data_group_total = REPORTS[('country_region', bool(exposureEUR))]
+
+        # Exclude the Countries that are not needed, the currency and the other asset classes
+        regions = self.cells['Region'].dropna().unique()
+        asset_classes = [asset_class for asset_class in Asset_Class if asset_class != 'Currency']
+        where = {'Region': regions, 'Asset_Class': asset_classes}
+        result = self.rollup(data_group, data_group_total, exposureEUR, fx_rates, where)
+
+        # Check wich exposure will be displayed
+        columns_finalData = data_group + ['ExposurePercentage_' + name for name in EXPOSURES if name in exposure]
+        return result[columns_finalData]
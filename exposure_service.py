@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from main import (
+    EXPOSURES,
+    calculate_metrics,
+    calculate_metrics_CountryRegion,
+    map_country_region,
+    read_country_region,
+    read_portfolio,
+)
+
+REPORT_TYPES = ['subfund', 'country_region']
+
+
+class ExposureService:
+    """
+    Serves exposure queries on a portfolio kept in memory.
+    The queries received within 'window' seconds are answered by one computation per
+    (report, currency), run in an executor so the event loop stays responsive.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    country_region: Optional Dataframe with 'Country' and 'Region' (or CountryRegionIndex), needed for the country reports.
+    fx_rates: Optional FxRateStore used for the EUR conversion.
+    window: Number of seconds during which the queries are coalesced.
+    executor: Optional concurrent.futures executor. Default value the default executor of the loop.
+    """
+
+    def __init__(self, portfolio, country_region = None, fx_rates = None, window = 0.005, executor = None):
+        self.fx_rates = fx_rates
+        self.window = window
+        self.executor = executor
+        self.portfolio = portfolio
+        if country_region is not None:
+            self.portfolio, self.unmapped = map_country_region(country_region, portfolio)
+        self.asset_classes = list(pd.unique(np.asarray(portfolio['Asset_Class'], dtype=object)))
+
+        # Rows of every (Subfund_Code, Valuation_Date) partition
+        groups = self.portfolio.groupby(['Subfund_Code', 'Valuation_Date'], observed=True).indices
+        self._partitions = {(subfund, pd.Timestamp(date)): rows for (subfund, date), rows in groups.items()}
+
+        self._pending = []
+        self._flush = None
+        self._latencies = deque(maxlen=10000)
+        self.batches = 0
+
+    async def query(self, subfund, valuation_date, asset_class = None, exposureEUR = False, report = 'subfund'):
+        """
+        Returns the lines of the report for one subfund and valuation date.
+
+        Args():
+        subfund: Subfund_Code.
+        valuation_date: Valuation date (any format accepted by pd.Timestamp).
+        asset_class: Optional asset class. Default value all the asset classes.
+        exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+        report: 'subfund' (calculate_metrics) or 'country_region' (calculate_metrics_CountryRegion).
+        """
+        if report not in REPORT_TYPES:
+            raise ValueError(f"Unknown report {report!r}, expected one of {REPORT_TYPES}")
+        if report == 'country_region' and 'Region' not in self.portfolio.columns:
+            raise ValueError("The service was started without 'country_region'")
+
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((report, bool(exposureEUR)), (subfund, pd.Timestamp(valuation_date)), asset_class, future))
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._run_batch())
+        try:
+            return await future
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+
+    def latency_percentiles(self, percentiles = (50, 90, 99)):
+        """
+        Returns the percentiles of the latency of the last queries, in milliseconds.
+
+        Args():
+        percentiles: List of the percentiles.
+        """
+        if not self._latencies:
+            return {p: float('nan') for p in percentiles}
+        values = np.percentile(np.array(self._latencies) * 1000, percentiles)
+        return dict(zip(percentiles, values))
+
+    async def _run_batch(self):
+        await asyncio.sleep(self.window)
+        pending, self._pending, self._flush = self._pending, [], None
+        self.batches += 1
+
+        # One computation per report and currency, on the union of the requested partitions
+        loop = asyncio.get_running_loop()
+        batches = {}
+        for kind, partition, asset_class, future in pending:
+            batches.setdefault(kind, []).append((partition, asset_class, future))
+        for kind, queries in batches.items():
+            partitions = {partition for partition, asset_class, future in queries}
+            try:
+                results, empty = await loop.run_in_executor(self.executor, self._compute, kind, partitions)
+            except Exception as error:
+                for partition, asset_class, future in queries:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for partition, asset_class, future in queries:
+                result = results.get(partition, empty)
+                if asset_class is not None:
+                    result = result[result['Asset_Class'] == asset_class].reset_index(drop=True)
+                if not future.done():
+                    future.set_result(result)
+
+    def _compute(self, kind, partitions):
+        report, exposureEUR = kind
+        rows = [self._partitions[partition] for partition in partitions if partition in self._partitions]
+        rows = np.sort(np.concatenate(rows)) if rows else np.array([], dtype=int)
+        portfolio = self.portfolio.take(rows)
+
+        if report == 'subfund':
+            result = calculate_metrics(portfolio, exposureEUR, self.fx_rates)
+        else:
+            result = calculate_metrics_CountryRegion(None, portfolio, self.asset_classes, EXPOSURES, exposureEUR, self.fx_rates)
+
+        # Split the lines by partition
+        keys = zip(result['Subfund_Code'], pd.to_datetime(result['Valuation_Date']))
+        positions = {}
+        for position, key in enumerate(keys):
+            positions.setdefault(key, []).append(position)
+        results = {key: result.iloc[value].reset_index(drop=True) for key, value in positions.items()}
+        return results, result.iloc[0:0]
+
+    async def handle(self, reader, writer):
+        """
+        Connection handler of serve(). Every line received is a JSON query with the arguments of
+        query(), every line sent back is the JSON list of the lines of the report (or an error).
+        """
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                result = await self.query(**request)
+                response = result.to_json(orient='records', date_format='iso')
+            except Exception as error:
+                response = json.dumps({'error': str(error)})
+            writer.write(response.encode() + b'\n')
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, host = '127.0.0.1', port = 8765):
+        """
+        Serves the queries over TCP, one JSON query per line (see handle).
+
+        Args():
+        host: Address to listen on.
+        port: Port to listen on.
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve exposure queries on a portfolio kept in memory.")
+    parser.add_argument("--portfolio", default="example_portfolio.csv")
+    parser.add_argument("--country-region", default="country_region.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--window", type=float, default=0.005, help="seconds during which the queries are coalesced")
+    args = parser.parse_args()
+
+    service = ExposureService(
+        read_portfolio(args.portfolio),
+        read_country_region(args.country_region),
+        window=args.window,
+    )
+    print(f"Serving exposure queries on {args.host}:{args.port}")
+    asyncio.run(service.serve(args.host, args.port))
@@ -0,0 +1,215 @@
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The instrumentation is off by default. While it is off the decorated functions are called directly.
+_enabled = False
+_profile = False
+_sinks = []
+# Depth of the stage being measured, per thread (and per asyncio task)
+_depth = contextvars.ContextVar('instrumentation_depth', default=0)
+# A single profiler can be active at a time in the process
+_profiling = threading.Lock()
+
+
+class LoggingSink:
+    """
+    Sends every record to a logger, as JSON.
+
+    Args():
+    logger: Logger used. Default value the 'instrumentation' logger.
+    level: Logging level of the records.
+    """
+
+    def __init__(self, logger = None, level = logging.INFO):
+        self.logger = logger or logging.getLogger('instrumentation')
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, json.dumps(record, default=str))
+
+
+class JsonFileSink:
+    """
+    Appends every record to a JSON lines file.
+
+    Args():
+    file_name: Path of the file.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def __call__(self, record):
+        with open(self.file_name, 'a') as file:
+            file.write(json.dumps(record, default=str) + '\n')
+
+
+class CollectorSink:
+    """
+    Keeps the records in memory, in the list 'records'.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def to_frame(self):
+        """
+        Returns the records as a DataFrame.
+        """
+        return pd.DataFrame(self.records)
+
+
+def enable(*sinks, profile = False):
+    """
+    Turns the instrumentation on. Every instrumented stage emits one record (a dict) to each sink.
+
+    Args():
+    sinks: Callables receiving the records, e.g. LoggingSink, JsonFileSink or CollectorSink.
+    profile: Boolean which also captures a cProfile summary and the tracemalloc peak of the outermost stages.
+    """
+    global _enabled, _profile, _sinks
+    _sinks = list(sinks)
+    _profile = profile
+    _enabled = True
+
+
+def disable():
+    """
+    Turns the instrumentation off and removes the sinks.
+    """
+    global _enabled, _profile, _sinks
+    _enabled = False
+    _profile = False
+    _sinks = []
+
+
+def is_enabled():
+    return _enabled
+
+
+def _size(data):
+    # Number of rows and memory of a DataFrame (or Series), None for the other objects
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        memory = data.memory_usage(index=True, deep=False)
+        if isinstance(data, pd.DataFrame):
+            memory = memory.sum()
+        return len(data), int(memory)
+    return None, None
+
+
+def _max_rss_mb():
+    if resource is None:
+        return 0.0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+@contextmanager
+def stage(name, inputs = ()):
+    """
+    Measures the block as the stage 'name' and yields a dict where the block can store its output ('output').
+    Nothing is measured while the instrumentation is off.
+
+    Args():
+    name: Name of the stage.
+    inputs: Inputs of the stage (DataFrames for the row counts and sizes, paths for the file sizes).
+    """
+    if not _enabled:
+        yield {}
+        return
+
+    depth = _depth.get()
+    record = {'stage': name, 'depth': depth}
+    rows, size = None, None
+    for data in inputs:
+        data_rows, data_size = _size(data)
+        if data_rows is not None and (rows is None or data_rows > rows):
+            rows, size = data_rows, data_size
+        if isinstance(data, (str, os.PathLike)) and os.path.isfile(data):
+            record['file_bytes'] = os.path.getsize(data)
+    record['rows_in'] = rows
+    record['bytes_in'] = size
+
+    # Only the outermost stage is profiled. A single profiler can be active at a time, so while
+    # a stage of another thread is profiled the stage is measured without the profile.
+    profiler = None
+    if _profile and depth == 0 and _profiling.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        memory_start = tracemalloc.get_traced_memory()[0]
+        profiler.enable()
+
+    rss_start = _max_rss_mb()
+    result = {}
+    start = time.perf_counter()
+    token = _depth.set(depth + 1)
+    try:
+        yield result
+    finally:
+        _depth.reset(token)
+        record['seconds'] = time.perf_counter() - start
+        record['max_rss_delta_mb'] = _max_rss_mb() - rss_start
+        if profiler is not None:
+            try:
+                profiler.disable()
+                # The peak is the one of the process, the other threads allocate too
+                record['peak_mb'] = (tracemalloc.get_traced_memory()[1] - memory_start) / 2**20
+                if not tracing:
+                    tracemalloc.stop()
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+                record['profile'] = stream.getvalue()
+            finally:
+                _profiling.release()
+        record['rows_out'], record['bytes_out'] = _size(result.get('output'))
+        for sink in _sinks:
+            sink(record)
+
+
+def instrumented(name = None):
+    """
+    Decorator measuring every call of the function as a stage (see stage).
+    While the instrumentation is off the function is called directly.
+
+    Args():
+    name: Name of the stage. Default value the name of the function.
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with stage(stage_name, list(args) + list(kwargs.values())) as result:
+                result['output'] = function(*args, **kwargs)
+            return result['output']
+
+        return wrapper
+
+    return decorator
@@ -1,6 +1,89 @@
+import os
+import warnings
+
+import numpy as np
 import pandas as pd
 
-def read_portfolio(file_name: str, anonymize: bool = False) -> pd.DataFrame:
+from instrumentation import instrumented
+
+## Currencies in EUR
+EUR_RATES = {
+    'EUR': 1.0,
+    'USD': 1.18,
+    'CNY': 7.63,
+    'JPY': 129.70,
+    'RUB': 86.79,
+}
+
+## Exposures reported by the metric functions
+EXPOSURES = ['net', 'long', 'short', 'gross']
+
+## Lines and denominator (Total_CCY) of each report, in Asset CCY (False) and in EUR (True)
+REPORTS = {
+    ('subfund', False): (
+        ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY'],
+        ['Subfund_Code', 'Valuation_Date', 'Asset_CCY'],
+    ),
+    ('subfund', True): (
+        ['Subfund_Code', 'Valuation_Date', 'Asset_Class'],
+        ['Subfund_Code', 'Valuation_Date'],
+    ),
+    ('country_region', False): (
+        ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Country_of_Risk', 'Region'],
+        ['Subfund_Code', 'Valuation_Date', 'Asset_CCY'],
+    ),
+    ('country_region', True): (
+        ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Country_of_Risk', 'Region'],
+        ['Subfund_Code', 'Valuation_Date'],
+    ),
+}
+
+## Low-cardinality columns stored as categoricals by the loaders
+PORTFOLIO_CATEGORICAL = ["Subfund_Code", "Subfund_CCY", "Subfund_Long_Name", "Asset_CCY", "Asset_Class", "Country_of_Risk", "Sector"]
+COUNTRY_REGION_CATEGORICAL = ["Country", "Region"]
+NAVS_CATEGORICAL = ["Subfund_Code"]
+
+def _cache_signature(file_name: str, categorical: bool) -> bytes:
+    # The cache is invalidated when the size or the modification time of the source changes
+    stat = os.stat(file_name)
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{int(categorical)}".encode()
+
+def _read_cache(file_name: str, signature: bytes):
+    """
+    Returns the DataFrame stored in the Feather cache next to 'file_name',
+    or None when there is no valid cache (or pyarrow is not installed).
+    """
+    try:
+        from pyarrow import feather
+    except ImportError:
+        return None
+    cache_name = file_name + ".feather"
+    if not os.path.exists(cache_name):
+        return None
+    try:
+        table = feather.read_table(cache_name, memory_map=True)
+    except Exception:
+        return None
+    if (table.schema.metadata or {}).get(b"source_signature") != signature:
+        return None
+    return table.to_pandas()
+
+def _write_cache(file_name: str, signature: bytes, df: pd.DataFrame) -> None:
+    try:
+        import pyarrow as pa
+        from pyarrow import feather
+    except ImportError:
+        return
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"source_signature"] = signature
+    table = table.replace_schema_metadata(metadata)
+    # Write to a temporary file first so a concurrent reader never sees a partial cache
+    cache_name = file_name + ".feather"
+    feather.write_feather(table, cache_name + ".tmp")
+    os.replace(cache_name + ".tmp", cache_name)
+
+def _portfolio_csv_options(categorical: bool) -> dict:
     # Define data types
     dtypes = {
         "Subfund_Code": "str",
@@ -14,9 +97,9 @@ def read_portfolio(file_name: str, anonymize: bool = False) -> pd.DataFrame:
         "Sector": "str",
         "Is_Hedge": "bool",
     }
-    # Read the CSV
-    df = pd.read_csv(
-        file_name,
+    if categorical:
+        dtypes.update({column: "category" for column in PORTFOLIO_CATEGORICAL + ["Valuation_Date"]})
+    return dict(
         delimiter=",",
         dtype=dtypes,
         squeeze=True,
@@ -25,19 +108,86 @@ def read_portfolio(file_name: str, anonymize: bool = False) -> pd.DataFrame:
         false_values=["No"],
         skipfooter=False,
     )
-    # Parse dates
-    df["Valuation_Date"] = pd.to_datetime(df["Valuation_Date"], format="%d/%m/%Y").dt.date # The error was in the format date
+
+def _parse_portfolio_dates(dates: pd.Series, categorical: bool) -> pd.Series:
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        # Parse the distinct dates only and take them with the codes, so the result is datetime64
+        categories = pd.to_datetime(dates.cat.categories, format="%d/%m/%Y")
+        parsed = categories.take(dates.cat.codes.to_numpy(), allow_fill=True, fill_value=pd.NaT)
+        return pd.Series(parsed, index=dates.index, name=dates.name)
+    dates = pd.to_datetime(dates, format="%d/%m/%Y") # The error was in the format date
+    if not categorical:
+        dates = dates.dt.date
+    return dates
+
+@instrumented()
+def read_portfolio(file_name: str, anonymize: bool = False, categorical: bool = False, cache: bool = False) -> pd.DataFrame:
+    """
+    Reads the portfolio CSV.
+
+    Args():
+    file_name: Path of the CSV.
+    anonymize: Replace the subfund long name.
+    categorical: Store the low-cardinality columns as categoricals and Valuation_Date as datetime64.
+    cache: Keep a Feather copy next to the CSV and reuse it while the CSV is unchanged (requires pyarrow).
+    """
+    df = None
+    if cache:
+        signature = _cache_signature(file_name, categorical)
+        df = _read_cache(file_name, signature)
+
+    if df is None:
+        # Read the CSV
+        df = pd.read_csv(file_name, **_portfolio_csv_options(categorical))
+        # Parse dates
+        df["Valuation_Date"] = _parse_portfolio_dates(df["Valuation_Date"], categorical)
+        if cache:
+            _write_cache(file_name, signature, df)
+
     # Anonymize subfund name
     if anonymize:
-        portfolio["Subfund_Long_Name"] = portfolio["Subfund_Long_Name"].replace({"简": "subfund001"})
+        df["Subfund_Long_Name"] = df["Subfund_Long_Name"].replace({"简": "subfund001"})
     return df
 
-def read_country_region(file_name: str) -> pd.DataFrame:
+def read_portfolio_chunks(file_name: str, chunksize: int = 100000, categorical: bool = False):
+    """
+    Reads the portfolio CSV in chunks of 'chunksize' rows.
+    Each chunk is parsed like the output of read_portfolio.
+
+    Args():
+    file_name: Path of the CSV.
+    chunksize: Number of rows per chunk.
+    categorical: Store the low-cardinality columns as categoricals and Valuation_Date as datetime64.
+    """
+    options = _portfolio_csv_options(categorical)
+    options.pop("squeeze")
+    for df in pd.read_csv(file_name, chunksize=chunksize, **options):
+        df["Valuation_Date"] = _parse_portfolio_dates(df["Valuation_Date"], categorical)
+        yield df
+
+@instrumented()
+def read_country_region(file_name: str, categorical: bool = False, cache: bool = False) -> pd.DataFrame:
+    """
+    Reads the CSV with the 'Country' and 'Region' columns.
+
+    Args():
+    file_name: Path of the CSV.
+    categorical: Store the columns as categoricals.
+    cache: Keep a Feather copy next to the CSV and reuse it while the CSV is unchanged (requires pyarrow).
+    """
+    if cache:
+        signature = _cache_signature(file_name, categorical)
+        df = _read_cache(file_name, signature)
+        if df is not None:
+            return df
+
     # Define data types
     dtypes = {
         "Country": "str",
         "Region": "str",
     }
+    if categorical:
+        dtypes.update({column: "category" for column in COUNTRY_REGION_CATEGORICAL})
     # Read the CSV
     df = pd.read_csv(
         file_name,
@@ -49,10 +199,26 @@ def read_country_region(file_name: str) -> pd.DataFrame:
         false_values=["No"],
         skipfooter=False,
     )
+    if cache:
+        _write_cache(file_name, signature, df)
 
     return df
 
-def read_subfund_navs(file_name: str) -> pd.DataFrame:
+@instrumented()
+def read_subfund_navs(file_name: str, categorical: bool = False, cache: bool = False) -> pd.DataFrame:
+    """
+    Reads the workbook with the NAV history of the subfunds.
+
+    Args():
+    file_name: Path of the Excel file.
+    categorical: Store Subfund_Code as a categorical and Valuation_Date as datetime64.
+    cache: Keep a Feather copy next to the workbook and reuse it while the workbook is unchanged (requires pyarrow).
+    """
+    if cache:
+        signature = _cache_signature(file_name, categorical)
+        df = _read_cache(file_name, signature)
+        if df is not None:
+            return df
    
     dtypes = {
         "Subfund_Code": "str",
@@ -69,12 +235,228 @@ def read_subfund_navs(file_name: str) -> pd.DataFrame:
     )
 
     # Parse dates
-    df["Valuation_Date"] = pd.to_datetime(df["Valuation_Date"], format="%Y/%m/%d").dt.date # The error was in the format date
-
+    df["Valuation_Date"] = pd.to_datetime(df["Valuation_Date"], format="%Y/%m/%d") # The error was in the format date
+    if categorical:
+        for column in NAVS_CATEGORICAL:
+            df[column] = df[column].astype("category")
+    else:
+        df["Valuation_Date"] = df["Valuation_Date"].dt.date
+    if cache:
+        _write_cache(file_name, signature, df)
 
     return df
     
-def calculate_metrics(portfolio, exposureEUR = False):
+@instrumented()
+def read_fx_rates(file_name: str) -> pd.DataFrame:
+    """
+    Reads the CSV with the history of the EUR rates ('Date', 'Currency', 'Rate').
+    The rate is the number of units of the currency for one EUR, as in EUR_RATES.
+
+    Args():
+    file_name: Path of the CSV.
+    """
+    dtypes = {
+        "Date": "str",
+        "Currency": "str",
+        "Rate": "float",
+    }
+    df = pd.read_csv(
+        file_name,
+        delimiter=",",
+        dtype=dtypes,
+        engine="c",
+    )
+    # Parse dates
+    df["Date"] = pd.to_datetime(df["Date"], format="%d/%m/%Y")
+    return df
+
+class FxRateStore:
+    """
+    History of the EUR rates, held in sorted arrays per currency.
+    The rate of a deal is the last rate of its currency on or before its valuation date.
+    The rates of every currency resolved for a valuation date are cached, so later lookups
+    on the same dates do not search the history again.
+
+    Args():
+    fx_rates: DataFrame with 'Date', 'Currency' and 'Rate' (see read_fx_rates).
+    """
+
+    def __init__(self, fx_rates):
+        data = pd.DataFrame({
+            'Date': pd.to_datetime(fx_rates['Date']),
+            'Currency': np.asarray(fx_rates['Currency'], dtype=object),
+            'Rate': np.asarray(fx_rates['Rate'], dtype=float),
+        }).sort_values(['Currency', 'Date'], kind='mergesort')
+        self.currencies = pd.Index(sorted(set(data['Currency']) | {'EUR'}))
+        self._dates = {}
+        self._rates = {}
+        for currency, history in data.groupby('Currency', sort=False):
+            self._dates[currency] = history['Date'].to_numpy(dtype='datetime64[ns]')
+            self._rates[currency] = history['Rate'].to_numpy()
+        if 'EUR' not in self._dates:
+            self._dates['EUR'] = np.array(['1900-01-01'], dtype='datetime64[ns]')
+            self._rates['EUR'] = np.array([1.0])
+        # valuation date -> rates aligned with self.currencies
+        self._cache = {}
+
+    def rates_on(self, date):
+        """
+        Returns the rate of every currency as of 'date' (NaN before the first rate of a currency).
+
+        Args():
+        date: Valuation date.
+        """
+        date = pd.Timestamp(date)
+        self._resolve(pd.DatetimeIndex([date]))
+        return pd.Series(self._cache[date], index=self.currencies)
+
+    def lookup(self, valuation_dates, currencies):
+        """
+        Returns the rate of every deal as an array (NaN when there is no rate).
+
+        Args():
+        valuation_dates: Series with the valuation date of each deal.
+        currencies: Series with the currency of each deal.
+        """
+        date_codes, dates = pd.factorize(np.asarray(valuation_dates, dtype=object))
+        dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(dates, dtype=object)))
+        self._resolve(dates)
+
+        # Rates of the valuation dates (lines) by currency (columns), with a NaN column for the unknown currencies
+        matrix = np.vstack([self._cache[date] for date in dates] or [np.empty(len(self.currencies))])
+        matrix = np.hstack([matrix, np.full((len(matrix), 1), np.nan)])
+        currency_codes = self.currencies.get_indexer(np.asarray(currencies, dtype=object))
+        return matrix[date_codes, currency_codes]
+
+    def to_frame(self):
+        """
+        Returns the history of the rates as a DataFrame with 'Date', 'Currency' and 'Rate', sorted by currency and date.
+        """
+        currencies = sorted(self._dates)
+        return pd.DataFrame({
+            'Date': np.concatenate([self._dates[currency] for currency in currencies]),
+            'Currency': np.repeat(currencies, [len(self._dates[currency]) for currency in currencies]).astype(object),
+            'Rate': np.concatenate([self._rates[currency] for currency in currencies]),
+        })
+
+    def _resolve(self, dates):
+        missing = pd.DatetimeIndex([date for date in dates.unique() if date not in self._cache])
+        if len(missing) == 0:
+            return
+        targets = missing.to_numpy(dtype='datetime64[ns]')
+        vectors = np.full((len(missing), len(self.currencies)), np.nan)
+        for column, currency in enumerate(self.currencies):
+            # As-of search of all the missing dates at once
+            positions = np.searchsorted(self._dates[currency], targets, side='right') - 1
+            found = positions >= 0
+            vectors[found, column] = self._rates[currency][positions[found]]
+        for date, vector in zip(missing, vectors):
+            self._cache[date] = vector
+
+def convert_to_eur(portfolio, fx_rates = None):
+    """
+    Returns the market value of each deal converted to EUR.
+    Deals in a currency without a rate are returned as NaN.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    fx_rates: Optional FxRateStore with the rates by date. Default value the fixed rates of EUR_RATES.
+    """
+    if fx_rates is None:
+        rates = portfolio['Asset_CCY'].map(EUR_RATES).astype(float)
+    else:
+        rates = fx_rates.lookup(portfolio['Valuation_Date'], portfolio['Asset_CCY'])
+    return portfolio['Market_Value_in_Subfund_CCY'] / rates
+
+
+def prepare_exposures(portfolio, data_group_total, values):
+    """
+    Returns the net, long, short and gross value of each deal and its denominator Total_CCY,
+    the gross total of the group 'data_group_total'.
+    The result can be shared by all the reports that use the same values and denominator.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    data_group_total: List of the columns used for the denominator.
+    values: Series with the market value of each deal (Asset CCY or EUR).
+    """
+    exposures = _exposure_columns(values)
+    exposures['Total_CCY'] = exposures['gross'].groupby(
+        [portfolio[column] for column in data_group_total], observed=True, sort=False
+    ).transform('sum')
+    return exposures
+
+
+@instrumented()
+def aggregate_exposures(portfolio, data_group, data_group_total, values, mask=None, exposures=None):
+    """
+    Aggregation kernel behind the exposure reports.
+    The net, long, short and gross sums are computed in a single grouped pass and
+    divided by the gross total of the group 'data_group_total' (Total_CCY).
+
+    Args():
+    portfolio: DataFrame with the deals.
+    data_group: List of the columns that define a line of the report.
+    data_group_total: List of the columns used for the denominator (must be included in data_group).
+    values: Series with the market value of each deal (Asset CCY or EUR).
+    mask: Optional boolean Series. Deals outside the mask still count in Total_CCY but are not reported.
+    exposures: Optional output of prepare_exposures for the same values and denominator, to reuse it.
+    """
+    # The denominator is computed on all the deals, before the mask is applied
+    if exposures is None:
+        exposures = prepare_exposures(portfolio, data_group_total, values)
+
+    keys = [portfolio[column] for column in data_group]
+    if mask is not None:
+        mask = mask.to_numpy(dtype=bool)
+        exposures = exposures[mask]
+        keys = [key[mask] for key in keys]
+
+    ###### Calculate the exposures
+    sums = exposures.groupby(keys, observed=True).agg(
+        {'net': 'sum', 'long': 'sum', 'short': 'sum', 'gross': 'sum', 'Total_CCY': 'first'}
+    ).sort_index()
+    return _exposure_percentages(sums, sums['Total_CCY'])
+
+
+def finalize_exposures(sums, data_group_total):
+    """
+    Turns the net, long, short and gross sums of each group into the exposure percentages.
+    The denominator Total_CCY is the gross sum of the group 'data_group_total'.
+
+    Args():
+    sums: DataFrame indexed by the report columns with the 'net', 'long', 'short' and 'gross' sums.
+    data_group_total: List of the index levels used for the denominator.
+    """
+    sums = sums.sort_index()
+    total = sums['gross'].groupby(level=data_group_total).transform('sum')
+    return _exposure_percentages(sums, total)
+
+
+def _exposure_columns(values, deals = False):
+    # Net, long, short and gross value of each deal, and a 'deals' count of 1 when asked
+    values = pd.Series(values)
+    array = values.to_numpy(dtype=float)
+    columns = pd.DataFrame({
+        'net': array,
+        'long': np.where(array > 0, array, 0.0),
+        'short': np.where(array < 0, array, 0.0),
+        'gross': np.abs(array),
+    }, index=values.index)
+    if deals:
+        columns['deals'] = 1
+    return columns
+
+
+def _exposure_percentages(sums, total):
+    result = pd.DataFrame(index=sums.index)
+    for name in EXPOSURES:
+        result['ExposurePercentage_' + name] = sums[name] / total * 100
+    return result.reset_index()
+
+
+@instrumented()
+def calculate_metrics(portfolio, exposureEUR = False, fx_rates = None):
     """
     This function calculates the following exposures in percentage: long, short, net and gross
     The metric is segregated by Subfundo, Validation date and Asset Class
@@ -83,296 +465,163 @@ def calculate_metrics(portfolio, exposureEUR = False):
     Args():
     portfolio: DataFrame with the deals.
     exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+    fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
     """
-    ## Currencies in EUR
-    EurUsd = 1.18
-    EurCny = 7.63
-    EurJpy = 129.70
-    EurRub = 86.79
-    
-    portfolio = portfolio.drop(['Subfund_Long_Name', 'Is_Hedge'], axis=1)
-    
     # Check if the exposure will be in EUR or in the asset CCY
+    # The total is grouped by subfund, Valuation date and Asset CCY, or by subfund and Valuation date in EUR
+    data_group, data_group_total = REPORTS[('subfund', bool(exposureEUR))]
     if exposureEUR == False:
-        
-        ###### group the total currency by subfund, Valuation date and Asset CCY.
-        data_group_total = ['Subfund_Code', 'Valuation_Date', 'Asset_CCY']
-        portfolio_totalCurrency = portfolio.copy()
-        # Calculate the total value by CCY
-        portfolio_totalCurrency['Market_Value_in_Subfund_CCY'] = portfolio['Market_Value_in_Subfund_CCY'].abs()
-        portfolio_totalCurrency = portfolio_totalCurrency.groupby(data_group_total).sum()
-        portfolio_totalCurrency = portfolio_totalCurrency.rename(columns = {'Market_Value_in_Subfund_CCY':'Total_CCY'})
-
-        # Merge the portfolio with the total currency information. This information is needed to calculate the percentage
-        portfolio = pd.merge(portfolio, portfolio_totalCurrency, on="Asset_CCY")
- 
-        # Define the features to group the information
-        data_group = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Total_CCY']
-
-        
-        ###### Calculate the exposures
-        # Metric - net exposure 
-        portfolio_net = portfolio.groupby(data_group, as_index=False).sum()
-        portfolio_net['ExposurePercentage_net'] = portfolio_net['Market_Value_in_Subfund_CCY']/portfolio_net['Total_CCY']*100
-    
-        # Metric - long exposure
-        portfolio_long = portfolio[portfolio['Market_Value_in_Subfund_CCY']>0].groupby(data_group, as_index=False).sum()
-        portfolio_long['ExposurePercentage_long'] = portfolio_long['Market_Value_in_Subfund_CCY']/portfolio_long['Total_CCY']*100
-    
-        # Metric - short exposure
-        portfolio_short = portfolio[portfolio['Market_Value_in_Subfund_CCY']<0].groupby(data_group, as_index=False).sum()
-        portfolio_short['ExposurePercentage_short'] = portfolio_short['Market_Value_in_Subfund_CCY']/portfolio_short['Total_CCY']*100
-    
-        # Metric - gross exposure
-        portfolio_gross = portfolio.copy()
-        portfolio_gross['Market_Value_in_Subfund_CCY'] = portfolio['Market_Value_in_Subfund_CCY'].abs()
-        portfolio_gross = portfolio_gross.groupby(data_group, as_index=False).sum()
-        portfolio_gross['ExposurePercentage_gross'] = portfolio_gross['Market_Value_in_Subfund_CCY']/portfolio_gross['Total_CCY']*100    
-        
-        # Merge data frames with the exposures
-        result1 = pd.merge(portfolio_short, portfolio_gross, on=data_group, how="outer")
-        result2 = pd.merge(portfolio_net, portfolio_long, on=data_group, how="outer")
-        
-        # Prepare the data frame with the correct information
-        result = pd.merge(result1, result2, on=data_group, how="outer").fillna(0)
-        result = result[['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'ExposurePercentage_net', 'ExposurePercentage_long', 'ExposurePercentage_short', 'ExposurePercentage_gross']]
-    
+        values = portfolio['Market_Value_in_Subfund_CCY']
     else:
-        
-        portfolio_totalCurrency = portfolio.copy()
-        
-        # Convert all the CCY in EUR
-        for i in range(portfolio.shape[0]):
-            if portfolio['Asset_CCY'][i] == 'USD':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurUsd
-            elif portfolio['Asset_CCY'][i] == 'CNY':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurCny
-            elif portfolio['Asset_CCY'][i] == 'JPY':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurJpy
-            elif portfolio['Asset_CCY'][i] == 'RUB':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurRub
-            elif portfolio['Asset_CCY'][i] == 'EUR':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]
-        
-        ###### group the total currency by subfund and Valuation.
-        data_group_total = ['Subfund_Code', 'Valuation_Date']
-        
-        
-        # Calculate the total value by CCY
-        portfolio_totalCurrency['Market_Value_in_Subfund_CCY'] = portfolio['EUR_CCY'].abs()
-        portfolio_totalCurrency = portfolio_totalCurrency.groupby(data_group_total).sum()
-        portfolio_totalCurrency = portfolio_totalCurrency.rename(columns = {'Market_Value_in_Subfund_CCY':'Total_CCY'})
-        
-        # Merge the portfolio with the total currency information. This information is needed to calculate the percentage
-        portfolio = pd.merge(portfolio, portfolio_totalCurrency, on="Subfund_Code")
-        
-        # Define the features to group the information
-        data_group = ['Subfund_Code', 'Valuation_Date', 'Asset_Class',  'Total_CCY']
-        
-        ###### Calculate the exposures
-        # Metric - net exposure 
-        portfolio_net = portfolio.groupby(data_group, as_index=False).sum()
-        portfolio_net['ExposurePercentage_net'] = portfolio_net['EUR_CCY']/portfolio_net['Total_CCY']*100
-    
-        # Metric - long exposure
-        portfolio_long = portfolio[portfolio['Market_Value_in_Subfund_CCY']>0].groupby(data_group, as_index=False).sum()
-        portfolio_long['ExposurePercentage_long'] = portfolio_long['EUR_CCY']/portfolio_long['Total_CCY']*100
-    
-        # Metric - short exposure
-        portfolio_short = portfolio[portfolio['Market_Value_in_Subfund_CCY']<0].groupby(data_group, as_index=False).sum()
-        portfolio_short['ExposurePercentage_short'] = portfolio_short['EUR_CCY']/portfolio_short['Total_CCY']*100
-    
-        # Metric - gross exposure
-        portfolio_gross = portfolio.copy()
-        portfolio_gross['Market_Value_in_Subfund_CCY'] = portfolio['EUR_CCY'].abs()
-        portfolio_gross = portfolio_gross.groupby(data_group, as_index=False).sum()
-        portfolio_gross['ExposurePercentage_gross'] = portfolio_gross['EUR_CCY']/portfolio_gross['Total_CCY']*100    
-    
-        data_group = ['Subfund_Code', 'Valuation_Date', 'Asset_Class']
-        
-        # Merge data frames with the exposures
-        result1 = pd.merge(portfolio_short, portfolio_gross, on=data_group, how="outer")
-        result2 = pd.merge(portfolio_net, portfolio_long, on=data_group, how="outer")
-        result = pd.merge(result1, result2, on=data_group, how="outer").fillna(0)
-        result = result[['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'ExposurePercentage_net', 'ExposurePercentage_long', 'ExposurePercentage_short', 'ExposurePercentage_gross']]
-        
-    return result
+        values = convert_to_eur(portfolio, fx_rates)
+
+    return aggregate_exposures(portfolio, data_group, data_group_total, values)
+
+
+@instrumented()
+def calculate_metrics_chunked(file_name, exposureEUR = False, chunksize = 100000, fx_rates = None):
+    """
+    Same report as calculate_metrics, streamed from the portfolio CSV.
+    The file is read in chunks and only the net, long, short and gross sums of each
+    (Subfund_Code, Valuation_Date, Asset_Class, Asset_CCY) group are kept in memory,
+    so the memory used depends on the number of groups and not on the number of deals.
+
+    Args():
+    file_name: Path of the portfolio CSV.
+    exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+    chunksize: Number of rows read at once.
+    fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+    """
+    data_group, data_group_total = REPORTS[('subfund', False)]
+
+    # Accumulate the partial sums of each chunk
+    sums = pd.DataFrame(columns=EXPOSURES, index=pd.MultiIndex.from_arrays([[]] * 4, names=data_group), dtype=float)
+    for chunk in read_portfolio_chunks(file_name, chunksize):
+        partial = _exposure_columns(chunk['Market_Value_in_Subfund_CCY']).groupby(
+            [chunk[column] for column in data_group], observed=True
+        ).sum()
+        sums = sums.add(partial, fill_value=0)
+
+    if exposureEUR == False:
+        return finalize_exposures(sums, data_group_total)
+
+    # All the deals of a group share the Asset CCY and the date, so the sums can be converted to EUR directly
+    if fx_rates is None:
+        rates = np.asarray(sums.index.get_level_values('Asset_CCY').map(EUR_RATES), dtype=float)
+    else:
+        rates = fx_rates.lookup(sums.index.get_level_values('Valuation_Date'), sums.index.get_level_values('Asset_CCY'))
+    sums = sums.div(rates, axis=0)
+    data_group, data_group_total = REPORTS[('subfund', True)]
+    sums = sums.groupby(level=data_group).sum()
+    return finalize_exposures(sums, data_group_total)
     
     
-def calculate_metrics_CountryRegion(country_region, portfolio, Asset_Class = ['Equity', 'Fixed Income'] , exposure = ['net', 'long', 'short', 'gross'], exposureEUR = False):
+class CountryRegionIndex:
+    """
+    Country to region lookup compiled once from the 'country_region' DataFrame.
+    The regions are stored as a categorical, so mapping the deals is a single take on the codes.
+
+    Args():
+    country_region: Dataframe with 'Country' and 'Region'
+    """
+
+    def __init__(self, country_region):
+        mapping = country_region.dropna(subset=['Country']).drop_duplicates('Country')
+        self.countries = pd.Index(np.asarray(mapping['Country'], dtype=object))
+        regions = pd.Categorical(np.asarray(mapping['Region'], dtype=object))
+        self.region_codes = np.asarray(regions.codes)
+        self.region_categories = regions.categories
+
+    def region_of(self, countries):
+        """
+        Returns the region of each country as a categorical Series (NaN for the unmapped countries).
+
+        Args():
+        countries: Series with the countries.
+        """
+        if isinstance(countries.dtype, pd.CategoricalDtype):
+            # Look up the categories only and take the result with the codes of the deals
+            positions = self.countries.get_indexer(countries.cat.categories)
+            positions = np.append(positions, -1)[np.asarray(countries.cat.codes)]
+        else:
+            positions = self.countries.get_indexer(countries)
+        codes = np.where(positions >= 0, self.region_codes[positions], -1)
+        regions = pd.Categorical.from_codes(codes, categories=self.region_categories)
+        return pd.Series(regions, index=countries.index, name='Region')
+
+
+@instrumented()
+def map_country_region(country_region, portfolio):
+    """
+    Adds the 'Region' column to the portfolio.
+    The mapped portfolio can be given to calculate_metrics_CountryRegion to avoid mapping it again.
+
+    Args():
+    country_region: Dataframe with 'Country' and 'Region', or the CountryRegionIndex built from it
+    portfolio: Dataframe with the assets
+
+    Returns the mapped portfolio and a DataFrame with the countries of risk that are not in
+    'country_region' (currency deals excluded) and their number of deals.
+    """
+    if not isinstance(country_region, CountryRegionIndex):
+        country_region = CountryRegionIndex(country_region)
+    portfolio = portfolio.assign(Region=country_region.region_of(portfolio['Country_of_Risk']))
+
+    ###### Check the assets
+    # Check if there is some country that is in the portfolio and it will not be consider
+    missing = portfolio['Region'].isnull() & (portfolio['Asset_Class'] != 'Currency')
+    unmapped = portfolio.loc[missing, 'Country_of_Risk'].astype(object).value_counts(dropna=False)
+    unmapped = unmapped.rename_axis('Country_of_Risk').reset_index(name='Deals')
+    return portfolio, unmapped
+
+
+def _warn_unmapped(unmapped, source = None):
+    # The deals of the countries that are not in the list are not reported
+    if len(unmapped):
+        countries = ', '.join(f'{country} ({deals})' for country, deals in zip(unmapped['Country_of_Risk'], unmapped['Deals']))
+        where = f" for {source}" if source is not None else ""
+        warnings.warn(f"Countries not included in the list{where} (number of deals): {countries}", stacklevel=2)
+
+
+@instrumented()
+def calculate_metrics_CountryRegion(country_region, portfolio, Asset_Class = ['Equity', 'Fixed Income'] , exposure = ['net', 'long', 'short', 'gross'], exposureEUR = False, fx_rates = None):
     
     """
     This function calculates the exposure by Country/region.
     The exposure can be calculated in the Asset CCY or in EUR.
     
     Args():
-    country_region: Dataframe with 'Country' and 'Region'
-    portfolio: Dataframe with the assets
+    country_region: Dataframe with 'Country' and 'Region', or the CountryRegionIndex built from it
+    portfolio: Dataframe with the assets, or the output of map_country_region to reuse the mapping between calls
+        (a warning lists the countries not included in the list when the portfolio is mapped here)
     Asset_Class: List of the asset classes to be calculated for the exposure. Default value 'Equity','Fixed Income'
+    exposure: List of the exposures to be displayed. Default value 'net', 'long', 'short', 'gross'
     exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY
+    fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
     """
-    ## Currencies in EUR
-    EurUsd = 1.18
-    EurCny = 7.63
-    EurJpy = 129.70
-    EurRub = 86.79
-        
-    portfolio = portfolio.drop(['Subfund_Long_Name', 'Is_Hedge'], axis=1)
+    # Map the country of each deal to its region, unless the portfolio is already mapped
+    if 'Region' not in portfolio.columns:
+        portfolio, unmapped = map_country_region(country_region, portfolio)
+        _warn_unmapped(unmapped)
+    mapped = portfolio['Region'].notnull()
+    not_currency = portfolio['Asset_Class'] != 'Currency'
 
     # Check if the exposure will be in EUR or in the asset CCY
+    data_group, data_group_total = REPORTS[('country_region', bool(exposureEUR))]
     if exposureEUR == False:
-    
-        ###### group the total currency by subfund, Valuation date and Asset CCY.
-        data_group_total = ['Subfund_Code', 'Valuation_Date', 'Asset_CCY']
-        portfolio_totalCurrency = portfolio.copy()
-        # Calculate the total value by CCY
-        portfolio_totalCurrency['Market_Value_in_Subfund_CCY'] = portfolio['Market_Value_in_Subfund_CCY'].abs()
-        portfolio_totalCurrency = portfolio_totalCurrency.groupby(data_group_total).sum()
-        portfolio_totalCurrency = portfolio_totalCurrency.rename(columns = {'Market_Value_in_Subfund_CCY':'Total_CCY'})
-
-        # Merge the portfolio with the total currency information. This information is needed to calculate the percentage
-        portfolio = pd.merge(portfolio, portfolio_totalCurrency, on="Asset_CCY")
-    
-        # Merge the data frame contry and region with portfolio
-        result = pd.merge(country_region, portfolio, how='outer', left_on='Country', right_on='Country_of_Risk')
-        
-        ###### Check the assets
-        # Check if there is some country that is in the portfolio and it will not be consider
-        print('Countries not included in the list:  ')
-        print(result[((result['Country'].isnull() == True) & (result['Asset_Class'] != 'Currency'))]['Country_of_Risk'])
-        
-        # Cash in the portfolio
-        cash = result[((result['Country'].isnull() == True) & (result['Asset_Class'] == 'Currency'))]
-    
-        # Exclude the Countries that are not needed and the currency
-        result = result[((result['Country'].isnull() == False) & (result['Asset_Class'] != 'Currency'))]
-    
-    
-        data_group = ['Country', 'Region','Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Country_of_Risk',  'Total_CCY']
-    
-        ###### Calculate the exposures
-        # Metric - net exposure 
-        portfolio_net = result.groupby(data_group, as_index=False).sum()
-        portfolio_net['ExposurePercentage_net'] = portfolio_net['Market_Value_in_Subfund_CCY']/portfolio_net['Total_CCY']*100
-    
-        # Metric - long exposure
-        portfolio_long = result[result['Market_Value_in_Subfund_CCY']>0].groupby(data_group, as_index=False).sum()
-        portfolio_long['ExposurePercentage_long'] = portfolio_long['Market_Value_in_Subfund_CCY']/portfolio_long['Total_CCY']*100
-    
-        # Metric - short exposure
-        portfolio_short = result[result['Market_Value_in_Subfund_CCY']<0].groupby(data_group, as_index=False).sum()
-        portfolio_short['ExposurePercentage_short'] = portfolio_short['Market_Value_in_Subfund_CCY']/portfolio_short['Total_CCY']*100
-    
-        # Metric - gross exposure
-        portfolio_gross = result.copy()
-        portfolio_gross['Market_Value_in_Subfund_CCY'] = result['Market_Value_in_Subfund_CCY'].abs()
-        portfolio_gross = portfolio_gross.groupby(data_group, as_index=False).sum()
-        portfolio_gross['ExposurePercentage_gross'] = portfolio_gross['Market_Value_in_Subfund_CCY']/portfolio_gross['Total_CCY']*100    
-        
-        # Merge the data frames
-        data_group = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Country_of_Risk', 'Region']
-        result1 = pd.merge(portfolio_short, portfolio_gross, on=data_group, how="outer")
-        result2 = pd.merge(portfolio_net, portfolio_long, on=data_group, how="outer")
-        result = pd.merge(result1, result2, on=data_group, how="outer").fillna(0)
-        
-        # Check wich exposure will be displayed
-        columns_finalData = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Country_of_Risk', 'Region']
-        if 'net' in exposure:
-            columns_finalData.append('ExposurePercentage_net')
-        if 'long' in exposure:
-            columns_finalData.append('ExposurePercentage_long')
-        if 'short' in exposure:
-            columns_finalData.append('ExposurePercentage_short')
-        if 'gross' in exposure:
-            columns_finalData.append('ExposurePercentage_gross')
-        result = result[columns_finalData]
-    
-    else:    
-        
-
-        
-        # Convert all the CCY in EUR
-        for i in range(portfolio.shape[0]):
-            if portfolio['Asset_CCY'][i] == 'USD':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurUsd
-            elif portfolio['Asset_CCY'][i] == 'CNY':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurCny
-            elif portfolio['Asset_CCY'][i] == 'JPY':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurJpy
-            elif portfolio['Asset_CCY'][i] == 'RUB':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]/EurRub
-            elif portfolio['Asset_CCY'][i] == 'EUR':
-                portfolio.loc[i,'EUR_CCY'] = portfolio['Market_Value_in_Subfund_CCY'][i]
-                
-        ###### group the total currency by subfund and Valuation.
-        data_group_total = ['Subfund_Code', 'Valuation_Date']
-        
-        # Calculate the total value by CCY
-        portfolio_totalCurrency = portfolio.copy()
-        portfolio_totalCurrency['EUR_CCY'] = portfolio['EUR_CCY'].abs()
-        portfolio_totalCurrency = portfolio_totalCurrency.groupby(data_group_total).sum()
-        portfolio_totalCurrency = portfolio_totalCurrency.rename(columns = {'EUR_CCY':'Total_CCY'})
-
-        
-        # Merge the portfolio with the total currency information. This information is needed to calculate the percentage
-        portfolio = pd.merge(portfolio, portfolio_totalCurrency, on="Subfund_Code")
-        
-        # Merge the data frame contry and region with portfolio
-        result = pd.merge(country_region, portfolio, how='outer', left_on='Country', right_on='Country_of_Risk')
-        
-        ###### Check the assets
-        # Check if there is some country that is in the portfolio and it will not be consider        
-        print('Countries not included in the list:  ')
-        print(result[((result['Country'].isnull() == True) & (result['Asset_Class'] != 'Currency'))]['Country_of_Risk'])
-    
-        # Cash in the portfolio
-        cash = result[((result['Country'].isnull() == True) & (result['Asset_Class'] == 'Currency'))]
-    
-        # Exclude the Countries that are not needed and the currency
-        result = result[((result['Country'].isnull() == False) & (result['Asset_Class'] != 'Currency'))]
-
-        data_group = ['Country', 'Region','Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Country_of_Risk',  'Total_CCY']
-        
-        ###### Calculate the exposures
-        # Metric - net exposure 
-        portfolio_net = result.groupby(data_group, as_index=False).sum()
-        portfolio_net['ExposurePercentage_net'] = portfolio_net['EUR_CCY']/portfolio_net['Total_CCY']*100
-    
-        # Metric - long exposure
-        portfolio_long = result[result['EUR_CCY']>0].groupby(data_group, as_index=False).sum()
-        portfolio_long['ExposurePercentage_long'] = portfolio_long['EUR_CCY']/portfolio_long['Total_CCY']*100
-    
-        # Metric - short exposure
-        portfolio_short = result[result['EUR_CCY']<0].groupby(data_group, as_index=False).sum()
-        portfolio_short['ExposurePercentage_short'] = portfolio_short['EUR_CCY']/portfolio_short['Total_CCY']*100
-    
-        # Metric - gross exposure
-        portfolio_gross = result.copy()
-        portfolio_gross['EUR_CCY'] = result['EUR_CCY'].abs()
-        portfolio_gross = portfolio_gross.groupby(data_group, as_index=False).sum()
-        portfolio_gross['ExposurePercentage_gross'] = portfolio_gross['EUR_CCY']/portfolio_gross['Total_CCY']*100    
-        
-        # Merge the data frames
-        data_group = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Country_of_Risk', 'Region']
-        result1 = pd.merge(portfolio_short, portfolio_gross, on=data_group, how="outer")
-        result2 = pd.merge(portfolio_net, portfolio_long, on=data_group, how="outer")
-        result = pd.merge(result1, result2, on=data_group, how="outer").fillna(0)
-        
-        # Check wich exposure will be displayed
-        columns_finalData = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Country_of_Risk', 'Region']
-        if 'net' in exposure:
-            columns_finalData.append('ExposurePercentage_net')
-        if 'long' in exposure:
-            columns_finalData.append('ExposurePercentage_long')
-        if 'short' in exposure:
-            columns_finalData.append('ExposurePercentage_short')
-        if 'gross' in exposure:
-            columns_finalData.append('ExposurePercentage_gross')
-        
-        result = result[columns_finalData]
-        
-    return result[result['Asset_Class'].isin(Asset_Class)]
+        values = portfolio['Market_Value_in_Subfund_CCY']
+    else:
+        values = convert_to_eur(portfolio, fx_rates)
+
+    # Exclude the Countries that are not needed, the currency and the other asset classes
+    mask = mapped & not_currency & portfolio['Asset_Class'].isin(Asset_Class)
+    result = aggregate_exposures(portfolio, data_group, data_group_total, values, mask=mask)
 
+    # Check wich exposure will be displayed
+    columns_finalData = data_group + ['ExposurePercentage_' + name for name in EXPOSURES if name in exposure]
+    return result[columns_finalData]
+
+@instrumented()
 def calculate_volAnnualized(df, subfundo = 'subfund001', date_vol = pd.Timestamp("2021-07-01")):
     df_data = df[(df['Subfund_Code'] == subfundo) & (df['Valuation_Date'] < date_vol)].copy()
     df_data = df_data.reset_index(drop=True)
@@ -391,9 +640,56 @@ def calculate_volAnnualized(df, subfundo = 'subfund001', date_vol = pd.Timestamp
         vol = df_data['NAV'].std()*(12**0.5)
     else:
         print("Check the data collection frequency!")
-        
+
     return vol
 
+## Number of periods per year by average number of days between two NAVs
+PERIODS_PER_YEAR = {1: 252, 7: 52, 30: 12}
+
+@instrumented()
+def calculate_volAnnualized_batch(df, window = None, min_periods = 2, on_returns = True):
+    """
+    Calculates the annualized volatility of every subfund as of every valuation date in one pass.
+    The volatility as of a date uses the NAVs up to and including that date, either all of them
+    (expanding window) or the last 'window' observations (rolling window).
+    The frequency is detected per subfund from the average number of days between two NAVs,
+    with the same rule as calculate_volAnnualized. Subfunds with another frequency get NaN.
+
+    Args():
+    df: DataFrame with the NAVs ('Subfund_Code', 'Valuation_Date', 'NAV').
+    window: Number of observations of the rolling window. Default value None (expanding window).
+    min_periods: Minimum number of observations to calculate a volatility.
+    on_returns: Boolean which calculates the volatility of the NAV returns or of the NAV levels (as calculate_volAnnualized).
+
+    Returns a DataFrame with the columns 'Subfund_Code', 'as_of' and 'vol'.
+    """
+    data = pd.DataFrame({
+        'Subfund_Code': df['Subfund_Code'],
+        'as_of': pd.to_datetime(df['Valuation_Date']),
+        'NAV': df['NAV'],
+    }).sort_values(['Subfund_Code', 'as_of'], kind='mergesort').reset_index(drop=True)
+    grouped = data.groupby('Subfund_Code', observed=True, sort=False)
+
+    # Check the period of the data collection of each subfund
+    gap = grouped['as_of'].diff().dt.days
+    gap = np.floor(gap.groupby(data['Subfund_Code'], observed=True, sort=False).transform('mean'))
+    periods = gap.map(PERIODS_PER_YEAR)
+
+    if on_returns:
+        values = grouped['NAV'].pct_change()
+    else:
+        values = data['NAV']
+    values = values.groupby(data['Subfund_Code'], observed=True, sort=False)
+    if window is None:
+        std = values.expanding(min_periods=min_periods).std()
+    else:
+        std = values.rolling(window, min_periods=min_periods).std()
+    std = std.reset_index(level=0, drop=True).reindex(data.index)
+
+    # Annualized the volatility
+    data['vol'] = std * np.sqrt(periods)
+    return data[['Subfund_Code', 'as_of', 'vol']]
+
 if __name__ == "__main__":
     print(f"pandas version: {pd.__version__}\n" )
     
@@ -409,15 +705,19 @@ if __name__ == "__main__":
     country_region = read_country_region('country_region.csv')
     country_names = list(country_region["Country"].unique())
     print(f"Successfully loaded these countries: {country_names}")
+
+    portfolio_region, unmapped = map_country_region(country_region, portfolio)
+    print('Countries not included in the list:  ')
+    print(unmapped)
     
     Asset_Class = ['Equity']
     Exposure = ['net']
     print(f"Calculate exposure {Exposure} for the asset class {Asset_Class}")
     
     print(f"Calculate exposure in Asset CCY \n" )
-    calculate_metrics_CountryRegion(country_region, portfolio, Asset_Class, Exposure, exposureEUR = False).to_csv(f'CountryRegion_Metric_AssetCCY.csv')
+    calculate_metrics_CountryRegion(country_region, portfolio_region, Asset_Class, Exposure, exposureEUR = False).to_csv(f'CountryRegion_Metric_AssetCCY.csv')
     print(f"Calculate exposure in EUR CCY \n")
-    calculate_metrics_CountryRegion(country_region, portfolio, Asset_Class, Exposure, exposureEUR = True).to_csv(f'CountryRegion_Metric_EurCCY.csv')
+    calculate_metrics_CountryRegion(country_region, portfolio_region, Asset_Class, Exposure, exposureEUR = True).to_csv(f'CountryRegion_Metric_EurCCY.csv')
     
     
     
@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from main import _warn_unmapped, calculate_metrics, calculate_metrics_CountryRegion, map_country_region
+
+## Partitions that are independent for the exposure reports
+PARTITION_COLUMNS = ['Subfund_Code', 'Valuation_Date']
+
+# Inputs shared with the worker processes. They are set once per worker by _init_worker,
+# so the tasks only carry the row range of the partitions to compute.
+_worker_portfolio = None
+_worker_country_region = None
+
+
+def _init_worker(portfolio, country_region):
+    global _worker_portfolio, _worker_country_region
+    _worker_portfolio = portfolio
+    _worker_country_region = country_region
+
+
+def _run_partition(function, start, stop, kwargs):
+    portfolio = _worker_portfolio.iloc[start:stop]
+    if function == 'calculate_metrics':
+        return calculate_metrics(portfolio, **kwargs)
+    return calculate_metrics_CountryRegion(_worker_country_region, portfolio, **kwargs)
+
+
+def partition_portfolio(portfolio, tasks):
+    """
+    Sorts the deals by subfund and valuation date and splits them in at most 'tasks'
+    contiguous row ranges. A (Subfund_Code, Valuation_Date) partition is never split.
+    The order of the deals inside a partition is kept.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    tasks: Maximum number of row ranges.
+    """
+    groups = portfolio.groupby(PARTITION_COLUMNS, observed=True, sort=True).indices
+    positions = list(groups.values())
+    if not positions:
+        return portfolio, []
+    portfolio = portfolio.take(np.concatenate(positions))
+
+    # Group the partitions in row ranges of similar size
+    bounds = np.cumsum([0] + [len(position) for position in positions])
+    target = bounds[-1] / max(tasks, 1)
+    ranges = []
+    start = 0
+    for stop in bounds[1:]:
+        if stop - start >= target or stop == bounds[-1]:
+            ranges.append((int(start), int(stop)))
+            start = stop
+    return portfolio, ranges
+
+
+def _run_parallel(function, portfolio, country_region, workers, kwargs):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    portfolio, ranges = partition_portfolio(portfolio, workers * 4)
+    if workers == 1 or len(ranges) <= 1:
+        _init_worker(portfolio, country_region)
+        results = [_run_partition(function, start, stop, kwargs) for start, stop in ranges]
+    else:
+        # With fork the workers inherit the inputs without copying them, otherwise they are sent once per worker
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_worker,
+            initargs=(portfolio, country_region),
+        ) as executor:
+            futures = [executor.submit(_run_partition, function, start, stop, kwargs) for start, stop in ranges]
+            results = [future.result() for future in futures]
+
+    if not results:
+        if function == 'calculate_metrics':
+            return calculate_metrics(portfolio, **kwargs)
+        return calculate_metrics_CountryRegion(country_region, portfolio, **kwargs)
+
+    # Same order of the lines as the serial report
+    result = pd.concat(results, ignore_index=True)
+    keys = [column for column in result.columns if not column.startswith('ExposurePercentage_')]
+    return result.sort_values(keys, kind='mergesort').reset_index(drop=True)
+
+
+def calculate_metrics_parallel(portfolio, exposureEUR = False, workers = None, fx_rates = None):
+    """
+    Same report as calculate_metrics, computed on a process pool.
+    Every (Subfund_Code, Valuation_Date) partition is computed independently.
+
+    Args():
+    portfolio: DataFrame with the deals.
+    exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+    workers: Number of processes. Default value the number of CPUs.
+    fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+    """
+    kwargs = {'exposureEUR': exposureEUR, 'fx_rates': fx_rates}
+    return _run_parallel('calculate_metrics', portfolio, None, workers, kwargs)
+
+
+def calculate_metrics_CountryRegion_parallel(country_region, portfolio, Asset_Class = ['Equity', 'Fixed Income'], exposure = ['net', 'long', 'short', 'gross'], exposureEUR = False, workers = None, fx_rates = None):
+    """
+    Same report as calculate_metrics_CountryRegion, computed on a process pool.
+    Every (Subfund_Code, Valuation_Date) partition is computed independently.
+
+    Args():
+    country_region: Dataframe with 'Country' and 'Region'
+    portfolio: Dataframe with the assets
+    Asset_Class: List of the asset classes to be calculated for the exposure. Default value 'Equity','Fixed Income'
+    exposure: List of the exposures to be displayed.
+    exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY
+    workers: Number of processes. Default value the number of CPUs.
+    fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+    """
+    kwargs = {'Asset_Class': Asset_Class, 'exposure': exposure, 'exposureEUR': exposureEUR, 'fx_rates': fx_rates}
+    # Map the regions once, before the portfolio is partitioned
+    if 'Region' not in portfolio.columns:
+        portfolio, unmapped = map_country_region(country_region, portfolio)
+        _warn_unmapped(unmapped)
+    return _run_parallel('calculate_metrics_CountryRegion', portfolio, country_region, workers, kwargs)
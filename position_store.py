@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from main import EUR_RATES, EXPOSURES, REPORTS, CountryRegionIndex
+
+## Columns kept by the store, as integer codes
+KEY_COLUMNS = ['Subfund_Code', 'Valuation_Date', 'Asset_Class', 'Asset_CCY', 'Country_of_Risk']
+
+
+class PositionStore:
+    """
+    Compact copy of a portfolio: an integer code array per key column, the labels of the codes
+    and the market values as a float64 array. The exposure reports are computed on these arrays
+    with masks and bincount sums, without copying the portfolio. The store has its own implementation
+    of the reports (calculate_metrics and calculate_metrics_CountryRegion keep the DataFrame path),
+    with the same results up to the rounding of the sums.
+
+    Args():
+    portfolio: DataFrame with the deals (output of read_portfolio).
+    """
+
+    def __init__(self, portfolio):
+        self.codes = {}
+        self.labels = {}
+        for column in KEY_COLUMNS:
+            values = portfolio[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, labels = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                codes, labels = pd.factorize(values, sort=True)
+                labels = pd.Index(labels)
+            # Missing values keep the code -1
+            self.codes[column] = np.asarray(codes).astype(np.int32)
+            self.labels[column] = labels
+        self.values = portfolio['Market_Value_in_Subfund_CCY'].to_numpy(dtype=np.float64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def nbytes(self):
+        """
+        Returns the memory used by the arrays of the store (labels excluded).
+        """
+        return self.values.nbytes + sum(codes.nbytes for codes in self.codes.values())
+
+    def eur_values(self, fx_rates = None):
+        """
+        Returns the market values converted to EUR (NaN for a currency without a rate).
+
+        Args():
+        fx_rates: Optional FxRateStore with the rates by date. Default value the fixed rates of EUR_RATES.
+        """
+        currencies = self.labels['Asset_CCY']
+        currency_codes = self.codes['Asset_CCY']
+        if fx_rates is None:
+            # Rate of every currency, taken with the codes of the deals
+            rates = np.append(np.asarray(currencies.map(EUR_RATES), dtype=float), np.nan)
+            return self.values / rates[currency_codes]
+        # Rate of every (date, currency) pair, taken with the codes of the deals
+        dates = self.labels['Valuation_Date']
+        date_codes, ccy_codes = np.meshgrid(np.arange(len(dates)), np.arange(len(currencies)), indexing='ij')
+        matrix = fx_rates.lookup(dates.take(date_codes.ravel()), currencies.take(ccy_codes.ravel()))
+        matrix = matrix.reshape(len(dates), len(currencies))
+        return self.values / matrix[self.codes['Valuation_Date'], currency_codes]
+
+    def calculate_metrics(self, exposureEUR = False, fx_rates = None):
+        """
+        Same report as calculate_metrics.
+
+        Args():
+        exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY.
+        fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+        """
+        data_group, data_group_total = REPORTS[('subfund', bool(exposureEUR))]
+        if exposureEUR == False:
+            values = self.values
+        else:
+            values = self.eur_values(fx_rates)
+        return self._exposures(data_group, data_group_total, values)
+
+    def calculate_metrics_CountryRegion(self, country_region, Asset_Class = ['Equity', 'Fixed Income'], exposure = ['net', 'long', 'short', 'gross'], exposureEUR = False, fx_rates = None):
+        """
+        Same report as calculate_metrics_CountryRegion.
+
+        Args():
+        country_region: Dataframe with 'Country' and 'Region', or the CountryRegionIndex built from it
+        Asset_Class: List of the asset classes to be calculated for the exposure. Default value 'Equity','Fixed Income'
+        exposure: List of the exposures to be displayed. Default value 'net', 'long', 'short', 'gross'
+        exposureEUR: Boolean which calculates the metrics in EUR (converting all the currency to EUR) or in the Asset CCY
+        fx_rates: Optional FxRateStore used for the EUR conversion. Default value the fixed rates of EUR_RATES.
+        """
+        if not isinstance(country_region, CountryRegionIndex):
+            country_region = CountryRegionIndex(country_region)
+
+        # Region of every country label, taken with the codes of the deals
+        regions = country_region.region_of(pd.Series(self.labels['Country_of_Risk']))
+        region_codes = np.append(np.asarray(regions.cat.codes), -1)[self.codes['Country_of_Risk']]
+
+        # Exclude the Countries that are not needed, the currency and the other asset classes
+        asset_classes = self.labels['Asset_Class']
+        allowed = np.append(asset_classes.isin(Asset_Class) & (asset_classes != 'Currency'), False)
+        mask = (region_codes >= 0) & allowed[self.codes['Asset_Class']]
+
+        data_group, data_group_total = REPORTS[('country_region', bool(exposureEUR))]
+        # The region depends on the country only, so it is added after the aggregation
+        data_group = [column for column in data_group if column != 'Region']
+        if exposureEUR == False:
+            values = self.values
+        else:
+            values = self.eur_values(fx_rates)
+
+        result = self._exposures(data_group, data_group_total, values, mask)
+        result.insert(len(data_group), 'Region', regions.take(self.labels['Country_of_Risk'].get_indexer(result['Country_of_Risk'])).to_numpy())
+
+        # Check wich exposure will be displayed
+        columns_finalData = data_group + ['Region'] + ['ExposurePercentage_' + name for name in EXPOSURES if name in exposure]
+        return result[columns_finalData]
+
+    def _group_ids(self, columns, valid):
+        # Mixed-radix id of the group of every deal, deals with a missing key are not valid
+        ids = np.zeros(len(self.values), dtype=np.int64)
+        for column in columns:
+            codes = self.codes[column]
+            valid &= codes >= 0
+            ids *= len(self.labels[column])
+            ids += codes
+        size = int(np.prod([len(self.labels[column]) for column in columns], dtype=np.float64))
+        return ids, valid, size
+
+    def _sum_by(self, columns, weights, valid):
+        # Returns the sorted ids of the groups with deals and the sums of every weight by group
+        ids, valid, size = self._group_ids(columns, valid)
+        if size <= max(4 * len(ids), 1 << 20):
+            # Dense ids: the invalid deals go to an extra bin
+            ids = np.where(valid, ids, size)
+            present = np.flatnonzero(np.bincount(ids, minlength=size + 1)[:size])
+            return present, [np.bincount(ids, weights=weight, minlength=size + 1)[present] for weight in weights]
+        present, inverse = np.unique(ids[valid], return_inverse=True)
+        return present, [np.bincount(inverse, weights=weight[valid], minlength=len(present)) for weight in weights]
+
+    def _exposures(self, data_group, data_group_total, values, mask = None):
+        # Deals in a currency without a rate do not contribute, like in calculate_metrics
+        values = np.nan_to_num(values, nan=0.0)
+        gross = np.abs(values)
+        weights = [values, np.maximum(values, 0.0), np.minimum(values, 0.0), gross]
+
+        ###### Calculate the exposures
+        valid = np.ones(len(values), dtype=bool) if mask is None else np.array(mask, dtype=bool)
+        present, sums = self._sum_by(data_group, weights, valid)
+        # The denominator is computed on all the deals, before the mask is applied
+        present_total, (totals,) = self._sum_by(data_group_total, [gross], np.ones(len(values), dtype=bool))
+
+        # Codes of the groups, and id of their denominator
+        dims = [len(self.labels[column]) for column in data_group]
+        codes = dict(zip(data_group, np.unravel_index(present, dims)))
+        total_ids = np.zeros(len(present), dtype=np.int64)
+        for column in data_group_total:
+            total_ids = total_ids * len(self.labels[column]) + codes[column]
+        total = totals[np.searchsorted(present_total, total_ids)]
+
+        result = pd.DataFrame({column: self.labels[column].take(codes[column]).to_numpy() for column in data_group})
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, values in zip(EXPOSURES, sums):
+                result['ExposurePercentage_' + name] = values / total * 100
+        return result
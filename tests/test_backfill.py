@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from backfill import backfill, read_exposures
+from main import calculate_metrics, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _write_snapshots(directory):
+    deals = pd.read_csv(os.path.join(ROOT, 'example_portfolio.csv'), dtype=str)
+    for date in ['19/01/2021', '20/01/2021']:
+        deals.assign(Valuation_Date=date).to_csv(os.path.join(directory, f"portfolio_{date.replace('/', '')}.csv"), index=False)
+
+
+def _expected(file_name):
+    expected = calculate_metrics(read_portfolio(file_name))
+    expected['Valuation_Date'] = pd.to_datetime(expected['Valuation_Date'])
+    return expected
+
+
+def _stored(output_dir, date):
+    return read_exposures(output_dir, 'Subfund_Metric_AssetCCY', start=date, end=date)
+
+
+def test_backfill_matches_calculate_metrics_and_skips_computed(tmp_path):
+    snapshots, store = tmp_path / 'snapshots', tmp_path / 'store'
+    snapshots.mkdir()
+    _write_snapshots(snapshots)
+
+    done = backfill(str(snapshots), str(store), workers=1)
+    assert sorted(done) == ['portfolio_19012021.csv', 'portfolio_20012021.csv']
+    expected = _expected(str(snapshots / 'portfolio_20012021.csv'))
+    stored = _stored(str(store), '2021-01-20')
+    pd.testing.assert_frame_equal(stored[expected.columns].astype(object), expected.astype(object))
+
+    assert backfill(str(snapshots), str(store), workers=1) == {}
+
+
+def test_backfill_recomputes_a_changed_snapshot(tmp_path):
+    snapshots, store = tmp_path / 'snapshots', tmp_path / 'store'
+    snapshots.mkdir()
+    _write_snapshots(snapshots)
+    backfill(str(snapshots), str(store), workers=1)
+
+    # Correct a market value of one snapshot
+    file_name = str(snapshots / 'portfolio_19012021.csv')
+    deals = pd.read_csv(file_name, dtype=str)
+    deals.loc[0, 'Market_Value_in_Subfund_CCY'] = str(float(deals.loc[0, 'Market_Value_in_Subfund_CCY']) * 3 + 1)
+    deals.to_csv(file_name, index=False)
+    stat = os.stat(file_name)
+    os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    done = backfill(str(snapshots), str(store), workers=1)
+    assert list(done) == ['portfolio_19012021.csv']
+    expected = _expected(file_name)
+    stored = _stored(str(store), '2021-01-19')
+    np.testing.assert_allclose(
+        stored['ExposurePercentage_net'].to_numpy(dtype=float),
+        expected['ExposurePercentage_net'].to_numpy(dtype=float),
+    )
+
+
+def test_backfill_removes_the_dates_dropped_from_a_changed_snapshot(tmp_path):
+    snapshots, store = tmp_path / 'snapshots', tmp_path / 'store'
+    snapshots.mkdir()
+    _write_snapshots(snapshots)
+    backfill(str(snapshots), str(store), workers=1)
+
+    # The snapshot of the 20th was saved with the wrong date
+    file_name = str(snapshots / 'portfolio_20012021.csv')
+    pd.read_csv(file_name, dtype=str).assign(Valuation_Date='21/01/2021').to_csv(file_name, index=False)
+    stat = os.stat(file_name)
+    os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    backfill(str(snapshots), str(store), workers=1)
+    assert len(_stored(str(store), '2021-01-20')) == 0
+    assert len(_stored(str(store), '2021-01-21')) > 0
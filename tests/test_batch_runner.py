@@ -0,0 +1,45 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from batch_runner import compute_reports, load_job, normalize_reports, run_job
+from main import calculate_metrics_CountryRegion, read_country_region, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORTFOLIO = os.path.join(ROOT, 'example_portfolio.csv')
+COUNTRY_REGION = os.path.join(ROOT, 'country_region.csv')
+
+
+def _write_job(tmp_path, portfolio_spec):
+    job = {
+        'output_dir': str(tmp_path / 'reports'),
+        'portfolios': [portfolio_spec],
+        'reports': [{'type': 'subfund', 'eur': False}, {'type': 'country_region', 'eur': True}],
+    }
+    file_name = tmp_path / 'job.json'
+    file_name.write_text(json.dumps(job))
+    return str(file_name)
+
+
+def test_country_reports_need_country_region(tmp_path):
+    with pytest.raises(ValueError, match='country_region'):
+        load_job(_write_job(tmp_path, {'file': PORTFOLIO}))
+
+    reports = normalize_reports([{'type': 'country_region'}])
+    with pytest.raises(ValueError, match='country_region'):
+        compute_reports(read_portfolio(PORTFOLIO), None, reports)
+
+
+def test_run_job_warns_about_unmapped_countries(tmp_path):
+    job = load_job(_write_job(tmp_path, {'file': PORTFOLIO, 'country_region': COUNTRY_REGION}))
+    with pytest.warns(UserWarning, match='example_portfolio.csv'):
+        files = run_job(job, workers=2)
+    assert len(files) == 2
+
+    country_region = read_country_region(COUNTRY_REGION)
+    expected = calculate_metrics_CountryRegion(country_region, read_portfolio(PORTFOLIO), exposureEUR=True)
+    result = pd.read_csv(os.path.join(job['output_dir'], 'example_portfolio_CountryRegion_Metric_EurCCY.csv'))
+    assert len(result) == len(expected)
+    pd.testing.assert_series_equal(result['ExposurePercentage_net'], expected['ExposurePercentage_net'])
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import generate_portfolio, write_portfolio
+from main import FxRateStore, calculate_metrics, calculate_metrics_chunked, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def portfolio_file(tmp_path_factory):
+    file_name = str(tmp_path_factory.mktemp('portfolio') / 'portfolio.csv')
+    write_portfolio(generate_portfolio(rows=5000, subfunds=4, dates=3), file_name)
+    return file_name
+
+
+def _fx_rates():
+    # The rates of fx_rates.csv, known before the dates of the generated portfolio
+    return FxRateStore(pd.read_csv(os.path.join(ROOT, 'fx_rates.csv')).assign(Date=pd.Timestamp('2021-01-01')))
+
+
+@pytest.mark.parametrize('exposureEUR', [False, True])
+@pytest.mark.parametrize('with_fx_rates', [False, True])
+def test_chunked_matches_calculate_metrics(portfolio_file, exposureEUR, with_fx_rates):
+    fx_rates = _fx_rates() if with_fx_rates else None
+    expected = calculate_metrics(read_portfolio(portfolio_file), exposureEUR, fx_rates)
+    result = calculate_metrics_chunked(portfolio_file, exposureEUR, chunksize=777, fx_rates=fx_rates)
+
+    keys = [column for column in expected.columns if not column.startswith('ExposurePercentage_')]
+    assert list(result.columns) == list(expected.columns)
+    assert expected['Subfund_Code'].nunique() > 1 and expected['Valuation_Date'].nunique() > 1
+    assert result[keys].astype(object).equals(expected[keys].astype(object))
+    np.testing.assert_allclose(
+        result.drop(columns=keys).to_numpy(dtype=float),
+        expected.drop(columns=keys).to_numpy(dtype=float),
+        rtol=1e-10,
+        atol=1e-9,
+    )
@@ -0,0 +1,34 @@
+import os
+import warnings
+
+import pytest
+
+from main import calculate_metrics_CountryRegion, map_country_region, read_country_region, read_portfolio
+from parallel import calculate_metrics_CountryRegion_parallel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def inputs():
+    country_region = read_country_region(os.path.join(ROOT, 'country_region.csv'))
+    portfolio = read_portfolio(os.path.join(ROOT, 'example_portfolio.csv'))
+    return country_region, portfolio
+
+
+def test_unmapped_countries_are_reported(inputs):
+    country_region, portfolio = inputs
+    portfolio_region, unmapped = map_country_region(country_region, portfolio)
+    assert len(unmapped) > 0
+
+    for function in [calculate_metrics_CountryRegion, calculate_metrics_CountryRegion_parallel]:
+        with pytest.warns(UserWarning, match=str(unmapped['Country_of_Risk'].iloc[0])):
+            function(country_region, portfolio)
+
+
+def test_mapped_portfolio_does_not_warn(inputs):
+    country_region, portfolio = inputs
+    portfolio_region, unmapped = map_country_region(country_region, portfolio)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UserWarning)
+        calculate_metrics_CountryRegion(country_region, portfolio_region)
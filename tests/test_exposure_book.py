@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from exposure_book import ExposureBook
+from main import calculate_metrics, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _portfolio():
+    return read_portfolio(os.path.join(ROOT, 'example_portfolio.csv'))
+
+
+def _assert_same_exposures(book, portfolio, exposureEUR):
+    expected = calculate_metrics(portfolio, exposureEUR)
+    result = book.exposures()
+    keys = [column for column in expected.columns if not column.startswith('ExposurePercentage_')]
+    expected = expected.sort_values(keys, kind='mergesort').reset_index(drop=True)
+    assert result[keys].astype(object).equals(expected[keys].astype(object))
+    np.testing.assert_allclose(
+        result.drop(columns=keys).to_numpy(dtype=float),
+        expected.drop(columns=keys).to_numpy(dtype=float),
+        rtol=1e-12,
+    )
+
+
+@pytest.mark.parametrize('exposureEUR', [False, True])
+def test_seeded_book_matches_calculate_metrics(exposureEUR):
+    portfolio = _portfolio()
+    book = ExposureBook(portfolio, exposureEUR)
+    assert len(book) == len(portfolio)
+    _assert_same_exposures(book, portfolio, exposureEUR)
+
+
+@pytest.mark.parametrize('exposureEUR', [False, True])
+def test_insert_update_delete_match_calculate_metrics(exposureEUR):
+    portfolio = _portfolio()
+    book = ExposureBook(portfolio.iloc[:-3], exposureEUR)
+
+    # Insert the last deals
+    book.upsert(portfolio.iloc[-3:])
+    _assert_same_exposures(book, portfolio, exposureEUR)
+
+    # Update the market value of some deals
+    updated = portfolio.iloc[[0, 2, 5]].copy()
+    updated['Market_Value_in_Subfund_CCY'] = -updated['Market_Value_in_Subfund_CCY'] * 2
+    book.upsert(updated)
+    portfolio = portfolio.copy()
+    portfolio.loc[updated.index, 'Market_Value_in_Subfund_CCY'] = updated['Market_Value_in_Subfund_CCY']
+    _assert_same_exposures(book, portfolio, exposureEUR)
+
+    # Delete some deals
+    book.delete(portfolio.iloc[[1, 3]])
+    portfolio = portfolio.drop(portfolio.index[[1, 3]])
+    _assert_same_exposures(book, portfolio, exposureEUR)
+
+
+def test_duplicated_deals_are_rejected():
+    portfolio = _portfolio()
+    duplicated = pd.concat([portfolio, portfolio.iloc[[0]]], ignore_index=True)
+    with pytest.raises(ValueError):
+        ExposureBook(duplicated)
+
+    book = ExposureBook(portfolio)
+    before = book.exposures()
+    with pytest.raises(ValueError):
+        book.upsert(duplicated.iloc[[0, -1]])
+    pd.testing.assert_frame_equal(book.exposures(), before)
+
+
+def test_removed_groups_are_reported():
+    portfolio = _portfolio()
+    book = ExposureBook(portfolio)
+
+    # asset013 is the only CNY deal of the portfolio
+    deal = portfolio[portfolio['Asset_Code'] == 'asset013']
+    changes = book.delete(deal)
+    removed = changes[changes['ExposurePercentage_net'].isnull()]
+    assert len(removed) == 1
+    assert list(removed[['Asset_Class', 'Asset_CCY']].iloc[0]) == ['Equity', 'CNY']
+    _assert_same_exposures(book, portfolio[portfolio['Asset_Code'] != 'asset013'], False)
+
+    # A deal moved to another group removes its previous group
+    moved = deal.assign(Asset_Class='Fixed Income')
+    book.upsert(deal)
+    changes = book.upsert(moved)
+    removed = changes[changes['ExposurePercentage_net'].isnull()]
+    assert list(removed['Asset_Class']) == ['Equity']
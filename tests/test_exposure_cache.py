@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from exposure_cache import ExposureCache
+from main import FxRateStore, calculate_metrics, calculate_metrics_CountryRegion, read_country_region, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _fx_rates(usd):
+    return FxRateStore(pd.DataFrame({
+        'Date': pd.to_datetime(['2021-01-18', '2021-01-18', '2021-01-18']),
+        'Currency': ['USD', 'JPY', 'CNY'],
+        'Rate': [usd, 130.0, 7.5],
+    }))
+
+
+def test_eur_results_depend_on_the_fx_rates():
+    portfolio = read_portfolio(os.path.join(ROOT, 'example_portfolio.csv'))
+    country_region = read_country_region(os.path.join(ROOT, 'country_region.csv'))
+    cache = ExposureCache()
+
+    for fx_rates in [None, _fx_rates(1.1), _fx_rates(1.5)]:
+        pd.testing.assert_frame_equal(
+            cache.calculate_metrics(portfolio, True, fx_rates),
+            calculate_metrics(portfolio, True, fx_rates),
+        )
+        pd.testing.assert_frame_equal(
+            cache.calculate_metrics_CountryRegion(country_region, portfolio, exposureEUR=True, fx_rates=fx_rates),
+            calculate_metrics_CountryRegion(country_region, portfolio, exposureEUR=True, fx_rates=fx_rates),
+        )
+    assert cache.stats()['misses'] == 6
+
+    # A store with the same history is a hit
+    cache.calculate_metrics(portfolio, True, _fx_rates(1.5))
+    assert cache.stats()['hits'] == 1
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from exposure_cube import ExposureCube
+from main import EXPOSURES, map_country_region, read_country_region, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _direct_rollup(portfolio, by):
+    values = portfolio['Market_Value_in_Subfund_CCY'].astype(float)
+    exposures = pd.DataFrame({
+        'net': values,
+        'long': values.where(values > 0, 0.0),
+        'short': values.where(values < 0, 0.0),
+        'gross': values.abs(),
+        'deals': 1,
+    })
+    keys = [np.asarray(portfolio[column], dtype=object) for column in by]
+    return exposures.groupby(keys, sort=True).sum().rename_axis(by).reset_index()
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+@pytest.mark.parametrize('by', [['Country_of_Risk'], ['Region'], ['Asset_CCY'], ['Subfund_Code', 'Region']])
+def test_rollup_matches_groupby(categorical, by):
+    country_region = read_country_region(os.path.join(ROOT, 'country_region.csv'))
+    portfolio = read_portfolio(os.path.join(ROOT, 'example_portfolio.csv'), categorical=categorical)
+    cube = ExposureCube(portfolio, country_region)
+
+    portfolio_region, unmapped = map_country_region(country_region, portfolio)
+    expected = _direct_rollup(portfolio_region, by)
+    result = cube.rollup(by)
+
+    assert result['deals'].sum() == expected['deals'].sum()
+    for column in by:
+        assert list(result[column].astype(object)) == list(expected[column])
+    np.testing.assert_allclose(result[EXPOSURES].to_numpy(), expected[EXPOSURES].to_numpy())
+    np.testing.assert_array_equal(result['deals'].to_numpy(), expected['deals'].to_numpy())
+
+
+def test_deals_without_country_stay_out_of_country_cells():
+    portfolio = read_portfolio(os.path.join(ROOT, 'example_portfolio.csv'))
+    cube = ExposureCube(portfolio)
+
+    assert cube.cells['Country_of_Risk'].isnull().sum() > 0
+    currency = cube.cells[cube.cells['Asset_Class'] == 'Currency']
+    assert currency['Country_of_Risk'].isnull().all()
+    # The deals without a country still count in the subfund totals
+    total = cube.rollup(['Subfund_Code'])
+    assert total['deals'].sum() == len(portfolio)
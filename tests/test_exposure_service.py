@@ -0,0 +1,51 @@
+import asyncio
+import os
+
+import pandas as pd
+import pytest
+
+from benchmark import generate_portfolio
+from exposure_service import ExposureService
+from main import calculate_metrics, calculate_metrics_CountryRegion, map_country_region, read_country_region
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('report', ['subfund', 'country_region'])
+@pytest.mark.parametrize('exposureEUR', [False, True])
+def test_coalesced_queries_match_the_reports(report, exposureEUR):
+    portfolio = generate_portfolio(rows=3000, subfunds=4, dates=3)
+    country_region = read_country_region(os.path.join(ROOT, 'country_region.csv'))
+    service = ExposureService(portfolio, country_region, window=0.05)
+    partitions = sorted(set(zip(portfolio['Subfund_Code'], portfolio['Valuation_Date'])))
+
+    async def run():
+        queries = [service.query(subfund, date, exposureEUR=exposureEUR, report=report) for subfund, date in partitions]
+        return await asyncio.gather(*queries)
+
+    results = asyncio.run(run())
+    # All the queries sent within the window are answered by one computation
+    assert service.batches == 1
+
+    if report == 'subfund':
+        expected = calculate_metrics(portfolio, exposureEUR)
+    else:
+        portfolio_region, unmapped = map_country_region(country_region, portfolio)
+        expected = calculate_metrics_CountryRegion(None, portfolio_region, ['Equity', 'Fixed Income', 'Currency'], exposureEUR=exposureEUR)
+    for (subfund, date), result in zip(partitions, results):
+        lines = expected[(expected['Subfund_Code'] == subfund) & (expected['Valuation_Date'] == date)].reset_index(drop=True)
+        assert len(result) > 0
+        pd.testing.assert_frame_equal(result, lines)
+
+
+def test_asset_class_filter_and_unknown_report():
+    portfolio = generate_portfolio(rows=500, subfunds=2, dates=2)
+    service = ExposureService(portfolio)
+    subfund, date = portfolio['Subfund_Code'].iloc[0], portfolio['Valuation_Date'].iloc[0]
+
+    result = asyncio.run(service.query(subfund, date, asset_class='Equity'))
+    assert list(result['Asset_Class'].unique()) == ['Equity']
+    with pytest.raises(ValueError):
+        asyncio.run(service.query(subfund, date, report='unknown'))
+    with pytest.raises(ValueError):
+        asyncio.run(service.query(subfund, date, report='country_region'))
@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import instrumentation
+from main import calculate_metrics, read_portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def collector():
+    sink = instrumentation.CollectorSink()
+    instrumentation.enable(sink, profile=True)
+    yield sink
+    instrumentation.disable()
+
+
+def test_depth_and_profile_with_concurrent_threads(collector):
+    portfolio = read_portfolio(os.path.join(ROOT, 'example_portfolio.csv'))
+    calls = 40
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda i: calculate_metrics(portfolio, i % 2 == 1), range(calls)))
+    assert len(results) == calls
+
+    records = [record for record in collector.records if record['stage'] == 'calculate_metrics']
+    assert len(records) == calls
+    # Every call of calculate_metrics is an outermost stage, whatever the other threads do
+    assert all(record['depth'] == 0 for record in records)
+    assert all(record['depth'] == 1 for record in collector.records if record['stage'] == 'aggregate_exposures')
+    assert any('profile' in record for record in records)
+
+
+def test_nested_stages(collector):
+    with instrumentation.stage('outer'):
+        with instrumentation.stage('inner'):
+            pass
+    depths = {record['stage']: record['depth'] for record in collector.records}
+    assert depths == {'inner': 1, 'outer': 0}
+    assert 'profile' in collector.records[-1]
@@ -0,0 +1,35 @@
+import os
+
+import pandas as pd
+import pytest
+
+from benchmark import generate_portfolio, write_portfolio
+from main import calculate_metrics, calculate_metrics_CountryRegion, map_country_region, read_country_region, read_portfolio
+from parallel import calculate_metrics_CountryRegion_parallel, calculate_metrics_parallel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def portfolio(tmp_path_factory):
+    file_name = str(tmp_path_factory.mktemp('portfolio') / 'portfolio.csv')
+    write_portfolio(generate_portfolio(rows=5000, subfunds=6, dates=4), file_name)
+    return read_portfolio(file_name)
+
+
+@pytest.mark.parametrize('exposureEUR', [False, True])
+def test_parallel_equals_serial(portfolio, exposureEUR):
+    pd.testing.assert_frame_equal(
+        calculate_metrics_parallel(portfolio, exposureEUR, workers=2),
+        calculate_metrics(portfolio, exposureEUR),
+    )
+
+
+@pytest.mark.parametrize('exposureEUR', [False, True])
+def test_parallel_country_region_equals_serial(portfolio, exposureEUR):
+    country_region = read_country_region(os.path.join(ROOT, 'country_region.csv'))
+    portfolio_region, unmapped = map_country_region(country_region, portfolio)
+    pd.testing.assert_frame_equal(
+        calculate_metrics_CountryRegion_parallel(country_region, portfolio_region, ['Equity', 'Fixed Income'], exposureEUR=exposureEUR, workers=2),
+        calculate_metrics_CountryRegion(country_region, portfolio_region, ['Equity', 'Fixed Income'], exposureEUR=exposureEUR),
+    )
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import generate_portfolio, write_portfolio
+from main import FxRateStore, calculate_metrics, calculate_metrics_CountryRegion, read_country_region, read_portfolio
+from position_store import PositionStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def portfolio_file(tmp_path_factory):
+    file_name = str(tmp_path_factory.mktemp('portfolio') / 'portfolio.csv')
+    write_portfolio(generate_portfolio(rows=5000, subfunds=4, dates=3, countries=10), file_name)
+    return file_name
+
+
+def _fx_rates():
+    # The rates of fx_rates.csv, known before the dates of the generated portfolio
+    return FxRateStore(pd.read_csv(os.path.join(ROOT, 'fx_rates.csv')).assign(Date=pd.Timestamp('2021-01-01')))
+
+
+def _assert_same_report(result, expected):
+    keys = [column for column in expected.columns if not column.startswith('ExposurePercentage_')]
+    assert list(result.columns) == list(expected.columns)
+    assert result[keys].astype(object).equals(expected[keys].astype(object))
+    np.testing.assert_allclose(
+        result.drop(columns=keys).to_numpy(dtype=float),
+        expected.drop(columns=keys).to_numpy(dtype=float),
+        rtol=1e-10,
+        atol=1e-9,
+    )
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+@pytest.mark.parametrize('exposureEUR', [False, True])
+@pytest.mark.parametrize('with_fx_rates', [False, True])
+def test_store_matches_the_dataframe_path(portfolio_file, categorical, exposureEUR, with_fx_rates):
+    fx_rates = _fx_rates() if with_fx_rates else None
+    country_region = read_country_region(os.path.join(ROOT, 'country_region.csv'))
+    portfolio = read_portfolio(portfolio_file, categorical=categorical)
+    store = PositionStore(portfolio)
+
+    _assert_same_report(store.calculate_metrics(exposureEUR, fx_rates), calculate_metrics(portfolio, exposureEUR, fx_rates))
+    with pytest.warns(UserWarning):
+        expected = calculate_metrics_CountryRegion(country_region, portfolio, exposureEUR=exposureEUR, fx_rates=fx_rates)
+    _assert_same_report(store.calculate_metrics_CountryRegion(country_region, exposureEUR=exposureEUR, fx_rates=fx_rates), expected)
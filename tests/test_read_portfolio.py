@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import generate_portfolio, write_portfolio
+from main import calculate_metrics, read_portfolio, read_portfolio_chunks
+
+
+@pytest.fixture(scope='module')
+def portfolio_file(tmp_path_factory):
+    file_name = str(tmp_path_factory.mktemp('portfolio') / 'portfolio.csv')
+    write_portfolio(generate_portfolio(rows=20000, subfunds=5, dates=4), file_name)
+    return file_name
+
+
+def test_categorical_dates_are_datetime64(portfolio_file):
+    portfolio = read_portfolio(portfolio_file, categorical=True)
+    assert len(portfolio) > 50
+    assert portfolio['Valuation_Date'].dtype == np.dtype('datetime64[ns]')
+    assert calculate_metrics(portfolio)['Valuation_Date'].dtype == np.dtype('datetime64[ns]')
+
+    plain = read_portfolio(portfolio_file)
+    assert list(portfolio['Valuation_Date'].dt.date) == list(plain['Valuation_Date'])
+
+
+def test_categorical_chunks_have_datetime64_dates(portfolio_file):
+    for chunk in read_portfolio_chunks(portfolio_file, chunksize=7000, categorical=True):
+        assert chunk['Valuation_Date'].dtype == np.dtype('datetime64[ns]')
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import PERIODS_PER_YEAR, calculate_volAnnualized_batch, read_subfund_navs
+from volatility_tracker import VolatilityTracker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WINDOW = 20
+ALPHA = 0.06
+
+
+@pytest.fixture(scope='module')
+def navs():
+    return read_subfund_navs(os.path.join(ROOT, 'subfunds_navs.xlsx'))
+
+
+def _batch_last(navs, **kwargs):
+    return calculate_volAnnualized_batch(navs, **kwargs).groupby('Subfund_Code').last()['vol'].sort_index()
+
+
+def _ewma_batch(navs):
+    data = navs.assign(as_of=pd.to_datetime(navs['Valuation_Date'])).sort_values('as_of')
+    result = {}
+    for subfund, history in data.groupby('Subfund_Code'):
+        periods = PERIODS_PER_YEAR.get(np.floor(history['as_of'].diff().dt.days.mean()), np.nan)
+        variance = history['NAV'].pct_change().ewm(alpha=ALPHA, adjust=False).var(bias=True).iloc[-1]
+        result[subfund] = np.sqrt(variance * periods)
+    return pd.Series(result).sort_index()
+
+
+def _in_order(navs):
+    return navs.assign(as_of=pd.to_datetime(navs['Valuation_Date'])).sort_values('as_of', kind='mergesort')
+
+
+def _shuffled_with_corrections(navs):
+    # Wrong NAVs first, then all the NAVs in a random order
+    wrong = navs.sample(200, random_state=1).assign(NAV=lambda df: df['NAV'] * 1.5)
+    return pd.concat([wrong, navs.sample(frac=1, random_state=2)])
+
+
+@pytest.mark.parametrize('on_returns', [True, False])
+@pytest.mark.parametrize('order', [_in_order, _shuffled_with_corrections])
+def test_tracker_matches_batch(navs, on_returns, order):
+    tracker = VolatilityTracker(window=WINDOW, alpha=ALPHA, on_returns=on_returns)
+    tracker.ingest(order(navs))
+    vols = tracker.vols().set_index('Subfund_Code').sort_index()
+
+    np.testing.assert_allclose(vols['vol'], _batch_last(navs, on_returns=on_returns), rtol=1e-9)
+    np.testing.assert_allclose(vols['vol_window'], _batch_last(navs, window=WINDOW, on_returns=on_returns), rtol=1e-9)
+    if on_returns:
+        np.testing.assert_allclose(vols['vol_ewma'], _ewma_batch(navs), rtol=1e-9)
+
+
+def test_known_navs_are_skipped(navs):
+    tracker = VolatilityTracker()
+    assert tracker.ingest(navs) == len(navs)
+    assert tracker.ingest(navs) == 0
@@ -0,0 +1,265 @@
+import math
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from main import PERIODS_PER_YEAR
+
+
+class _Moments:
+    # Welford running mean and variance, with the removal of a value
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        if math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if math.isnan(value):
+            return
+        if self.count <= 1:
+            self.__init__()
+            return
+        delta = value - self.mean
+        self.mean -= delta / (self.count - 1)
+        self.count -= 1
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count >= 2 else float('nan')
+
+
+class _Ewma:
+    # Exponentially weighted mean and variance, as pandas ewm(alpha, adjust=False) with var(bias=True)
+    __slots__ = ('alpha', 'count', 'mean', 'var')
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def add(self, value):
+        if math.isnan(value):
+            return
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+            return
+        delta = value - self.mean
+        increment = self.alpha * delta
+        self.mean += increment
+        self.var = (1 - self.alpha) * (self.var + delta * increment)
+
+    def std(self):
+        return math.sqrt(self.var) if self.count >= 2 else float('nan')
+
+
+class _SubfundState:
+    # NAV history of a subfund, sorted by date, with the values the statistics are computed on
+    __slots__ = ('dates', 'navs', 'values', 'moments', 'window', 'ewma')
+
+    def __init__(self, window, alpha):
+        self.dates = []
+        self.navs = []
+        self.values = []
+        self.moments = _Moments()
+        self.window = _Moments() if window is not None else None
+        self.ewma = _Ewma(alpha) if alpha is not None else None
+
+
+class VolatilityTracker:
+    """
+    Annualized volatility of the subfunds, updated NAV by NAV.
+    A NAV appended after the last date of its subfund updates the running statistics in O(1):
+    Welford mean/variance over the whole history and, optionally, over the last 'window'
+    observations and exponentially weighted (EWMA). A NAV for a date already known (correction)
+    or earlier than the last date (late NAV) is handled too: the expanding statistics are
+    corrected in O(1), the window statistics are recomputed when the window is affected and
+    the EWMA is recomputed over the history of the subfund.
+    The results are the same as calculate_volAnnualized_batch on the same NAVs, as of the last date.
+
+    Args():
+    window: Optional number of observations of the rolling window.
+    alpha: Optional smoothing factor of the EWMA (0 < alpha <= 1).
+    halflife: Optional half-life of the EWMA in number of observations (instead of alpha).
+    min_periods: Minimum number of observations to calculate a volatility.
+    on_returns: Boolean which calculates the volatility of the NAV returns or of the NAV levels (as calculate_volAnnualized).
+    """
+
+    def __init__(self, window = None, alpha = None, halflife = None, min_periods = 2, on_returns = True):
+        if halflife is not None:
+            alpha = 1 - math.exp(-math.log(2) / halflife)
+        if alpha is not None and not 0 < alpha <= 1:
+            raise ValueError(f"alpha must be in (0, 1], got {alpha}")
+        self.window = window
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.on_returns = on_returns
+        self._states = {}
+
+    def __contains__(self, subfund):
+        return subfund in self._states
+
+    def subfunds(self):
+        return list(self._states)
+
+    def update(self, subfund, valuation_date, nav):
+        """
+        Adds (or corrects) the NAV of a subfund at a valuation date.
+        Returns False when the NAV was already known, True otherwise.
+
+        Args():
+        subfund: Subfund_Code.
+        valuation_date: Valuation date (any format accepted by pd.Timestamp).
+        nav: NAV of the subfund at the valuation date.
+        """
+        state = self._states.get(subfund)
+        if state is None:
+            state = self._states[subfund] = _SubfundState(self.window, self.alpha)
+        date = pd.Timestamp(valuation_date)
+        nav = float(nav)
+        position = bisect_left(state.dates, date)
+
+        if position == len(state.dates):
+            # New last date: O(1) update
+            state.dates.append(date)
+            state.navs.append(nav)
+            state.values.append(self._value(state, position))
+            self._add_last(state)
+            return True
+
+        if state.dates[position] == date:
+            if state.navs[position] == nav or (math.isnan(nav) and math.isnan(state.navs[position])):
+                return False
+            # Correction of a known NAV: its value, and the return of the next date, change
+            changed = self._changed(state, position)
+            for index in changed:
+                state.moments.remove(state.values[index])
+            state.navs[position] = nav
+        else:
+            # Late NAV: the return of the next date changes, a value is inserted
+            changed = [position] if self.on_returns else []
+            for index in changed:
+                state.moments.remove(state.values[index])
+            state.dates.insert(position, date)
+            state.navs.insert(position, nav)
+            state.values.insert(position, float('nan'))
+            changed = self._changed(state, position)
+
+        for index in changed:
+            state.values[index] = self._value(state, index)
+            state.moments.add(state.values[index])
+        if state.window is not None and changed[-1] >= len(state.values) - self.window:
+            self._rebuild_window(state)
+        if state.ewma is not None:
+            self._rebuild_ewma(state)
+        return True
+
+    def ingest(self, df):
+        """
+        Adds the NAVs of a DataFrame (e.g. read_subfund_navs) in the order of the rows.
+        The NAVs already known are skipped, so the whole history can be ingested again
+        after new lines were added to the workbook.
+        Returns the number of NAVs added or corrected.
+
+        Args():
+        df: DataFrame with the NAVs ('Subfund_Code', 'Valuation_Date', 'NAV').
+        """
+        updated = 0
+        for subfund, valuation_date, nav in zip(df['Subfund_Code'], df['Valuation_Date'], df['NAV']):
+            updated += self.update(subfund, valuation_date, nav)
+        return updated
+
+    def vol(self, subfund, method = 'expanding'):
+        """
+        Returns the annualized volatility of a subfund as of its last NAV.
+        NaN with fewer than 'min_periods' observations or with a NAV frequency other than
+        daily, weekly or monthly (same rule as calculate_volAnnualized).
+
+        Args():
+        subfund: Subfund_Code.
+        method: 'expanding' (whole history), 'window' (last 'window' observations) or 'ewma'.
+        """
+        state = self._states[subfund]
+        if method == 'expanding':
+            moments = state.moments
+        elif method == 'window' and state.window is not None:
+            moments = state.window
+        elif method == 'ewma' and state.ewma is not None:
+            moments = state.ewma
+        else:
+            raise ValueError(f"The method {method!r} is not tracked")
+        if moments.count < self.min_periods:
+            return float('nan')
+        return moments.std() * math.sqrt(self._periods_per_year(state))
+
+    def vols(self):
+        """
+        Returns the annualized volatilities of all the subfunds as of their last NAV, as a DataFrame
+        with the columns 'Subfund_Code', 'as_of' and 'vol' (plus 'vol_window' and 'vol_ewma' when tracked).
+        """
+        columns = ['Subfund_Code', 'as_of', 'vol']
+        if self.window is not None:
+            columns.append('vol_window')
+        if self.alpha is not None:
+            columns.append('vol_ewma')
+        rows = []
+        for subfund, state in self._states.items():
+            row = {'Subfund_Code': subfund, 'as_of': state.dates[-1], 'vol': self.vol(subfund)}
+            if state.window is not None:
+                row['vol_window'] = self.vol(subfund, 'window')
+            if state.ewma is not None:
+                row['vol_ewma'] = self.vol(subfund, 'ewma')
+            rows.append(row)
+        return pd.DataFrame(rows, columns=columns)
+
+    def _value(self, state, index):
+        if not self.on_returns:
+            return state.navs[index]
+        if index == 0:
+            return float('nan')
+        return state.navs[index] / state.navs[index - 1] - 1
+
+    def _changed(self, state, position):
+        # Indexes of the values that depend on the NAV at 'position'
+        if self.on_returns and position + 1 < len(state.values):
+            return [position, position + 1]
+        return [position]
+
+    def _add_last(self, state):
+        value = state.values[-1]
+        state.moments.add(value)
+        if state.window is not None:
+            state.window.add(value)
+            if len(state.values) > self.window:
+                state.window.remove(state.values[-self.window - 1])
+        if state.ewma is not None:
+            state.ewma.add(value)
+
+    def _rebuild_window(self, state):
+        state.window = _Moments()
+        for value in state.values[-self.window:]:
+            state.window.add(value)
+
+    def _rebuild_ewma(self, state):
+        state.ewma = _Ewma(self.alpha)
+        for value in state.values:
+            state.ewma.add(value)
+
+    def _periods_per_year(self, state):
+        # Average number of days between two NAVs, as in calculate_volAnnualized_batch
+        if len(state.dates) < 2:
+            return float('nan')
+        gap = np.floor((state.dates[-1] - state.dates[0]).days / (len(state.dates) - 1))
+        return PERIODS_PER_YEAR.get(int(gap), float('nan'))